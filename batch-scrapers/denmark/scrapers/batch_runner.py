@@ -0,0 +1,107 @@
+# Copyright 2022 Meta Mind AB
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import asyncio
+import logging
+from pathlib import Path
+from typing import Callable, Optional
+
+import click
+
+from normative_batch_scrapers.pipeline import UploaderSettings, target_directory
+from normative_batch_scrapers.runner import RunnerSettings, ScraperRunner
+from normative_batch_scrapers.scraper.base import BatchScraper
+from normative_batch_scrapers.util import coro
+
+log = logging.getLogger(__name__)
+
+
+def _denmark() -> BatchScraper:
+    from normative_batch_scrapers.scraper.denmark.scraper import DenmarkScraper
+
+    return DenmarkScraper()
+
+
+# scrapers are created lazily so that only the selected ones are imported
+_SCRAPERS: dict[str, Callable[[], BatchScraper]] = {
+    "denmark": _denmark,
+}
+
+
+@click.command()
+@click.option(
+    "--directory",
+    type=click.Path(exists=True, dir_okay=True, path_type=Path),
+    required=True,
+    help="Directory to use for storage, keeps the scheduling state and failed uploads between runs.",
+)
+@click.option(
+    "--scraper",
+    "scrapers",
+    type=click.Choice(list(_SCRAPERS)),
+    multiple=True,
+    help="Scraper to run, repeat to run several. Defaults to all scrapers.",
+)
+@click.option(
+    "--max-concurrent-scrapers",
+    type=int,
+    default=2,
+    help="Nbr of scrapers to run at the same time",
+)
+@click.option(
+    "--max-transform-workers",
+    type=int,
+    help="Nbr of processes shared by all scrapers. Defaults to the nbr of cpus.",
+)
+@click.option(
+    "--batch-size",
+    type=int,
+    default=1000,
+    help="Nbr of companies to upload per batch",
+)
+@click.option("-v", "--verbose", is_flag=True, default=False)
+@coro
+async def cli(
+    directory: Path,
+    scrapers: tuple[str, ...],
+    max_concurrent_scrapers: int,
+    max_transform_workers: Optional[int],
+    batch_size: int,
+    verbose: bool,
+):
+    """
+    Runs several company registry scrapers concurrently, uploading to the Company Service.
+    """
+    if verbose:
+        logging.basicConfig(level=logging.DEBUG)
+        logging.getLogger("httpx").setLevel(logging.WARNING)
+    else:
+        logging.basicConfig(level=logging.INFO)
+    runner_settings = RunnerSettings(
+        max_concurrent_scrapers=max_concurrent_scrapers,
+        max_transform_workers=max_transform_workers,
+    )
+    upload_settings = UploaderSettings(batch_size=batch_size)
+    with target_directory(directory) as work_path:
+        runner = ScraperRunner(
+            [_SCRAPERS[name]() for name in scrapers or _SCRAPERS],
+            upload_settings,
+            runner_settings,
+            work_path,
+        )
+        await runner.run()
+
+
+if __name__ == "__main__":
+    asyncio.run(cli())
@@ -15,17 +15,22 @@
 import asyncio
 import logging
 from pathlib import Path
-from typing import Optional
+from typing import Any, Optional
 
 import click
 
-from normative_batch_scrapers.scraper.denmark.scraper import (
+from normative_batch_scrapers.governor import GovernorSettings, MemoryGovernor
+from normative_batch_scrapers.pipeline import (
+    RunSummary,
     UploaderSettings,
-    download_stream,
+    company_index,
+    dead_letter_store,
+    deduplicate,
+    replay,
     target_directory,
-    transform,
     upload,
 )
+from normative_batch_scrapers.scraper.denmark.scraper import download_stream, transform
 from normative_batch_scrapers.scraper.denmark.scrolldownloader import DownloaderSettings
 from normative_batch_scrapers.util import coro
 
@@ -62,7 +67,7 @@ async def cli(ctx, directory: Optional[Path], verbose: bool):
 @click.option(
     "--scroll-limit",
     type=int,
-    help="limit the number of scroll pages to download (for debug purposes)",
+    help="limit the number of scroll pages to download over all slices (for debug purposes)",
 )
 @click.option(
     "--scroll-page-size",
@@ -70,18 +75,28 @@ async def cli(ctx, directory: Optional[Path], verbose: bool):
     default=2000,
     help="the number of companies to request per scroll request",
 )
+@click.option(
+    "--scroll-slices",
+    type=int,
+    default=1,
+    help="the number of scroll slices to download in parallel",
+)
 @click.pass_obj
 @coro
 async def download_cmd(
     obj: Path,
     scroll_limit: Optional[int],
     scroll_page_size: int,
+    scroll_slices: int,
 ):
     log.info("Executing denmark downloader command")
     settings = DownloaderSettings(
-        scroll_limit=scroll_limit, scroll_page_size=scroll_page_size
+        scroll_limit=scroll_limit,
+        scroll_page_size=scroll_page_size,
+        scroll_slices=scroll_slices,
     )
-    await download_stream(settings, write_path=obj)
+    async with MemoryGovernor(GovernorSettings()) as governor:
+        await download_stream(settings, write_path=obj, governor=governor)
 
 
 @cli.command(
@@ -94,13 +109,61 @@ async def download_cmd(
     default=1000,
     help="Nbr of companies to upload per batch",
 )
+@click.option(
+    "--endpoint",
+    "endpoints",
+    multiple=True,
+    help="Company Service replica url, repeat to shard the upload over several replicas",
+)
+@click.option(
+    "--max-in-flight",
+    type=int,
+    default=2,
+    help="Nbr of concurrent batch uploads per replica when sharding",
+)
 @click.pass_obj
 @coro
-async def upload_cmd(obj: Path, batch_size: int):
+async def upload_cmd(
+    obj: Path, batch_size: int, endpoints: tuple[str, ...], max_in_flight: int
+):
     log.info("Executing denmark upload command")
-    settings = UploaderSettings(batch_size=batch_size)
-    cdtos = await transform(read_path=obj)
-    await upload(upload_settings=settings, dtos=cdtos)
+    # endpoints given on the command line take the place of API_URL(S)
+    overrides: dict[str, Any] = {}
+    if endpoints:
+        overrides = dict(
+            api_urls=list(endpoints), max_in_flight_per_endpoint=max_in_flight
+        )
+    settings = UploaderSettings(batch_size=batch_size, **overrides)
+    summary = RunSummary()
+    async with MemoryGovernor(GovernorSettings()) as governor:
+        with company_index(work_path=obj, governor=governor) as index:
+            chunks = transform(read_path=obj, governor=governor)
+            await deduplicate(chunks, index, summary)
+            await upload(
+                upload_settings=settings,
+                dtos=index,
+                dead_letters=dead_letter_store(obj),
+                summary=summary,
+                governor=governor,
+            )
+    summary.throttled_seconds = dict(governor.throttled)
+    log.info(f"Run summary: {summary}")
+
+
+@cli.command(
+    "replay",
+    help="Re-upload batches that previously failed to upload to the Company Service",
+)
+@click.pass_obj
+@coro
+async def replay_cmd(obj: Path):
+    log.info("Executing denmark replay command")
+    settings = UploaderSettings()
+    summary = RunSummary()
+    await replay(
+        upload_settings=settings, dead_letters=dead_letter_store(obj), summary=summary
+    )
+    log.info(f"Run summary: {summary}")
 
 
 if __name__ == "__main__":
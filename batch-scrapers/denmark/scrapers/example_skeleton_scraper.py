@@ -12,32 +12,67 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 #
-import os
-
-from company_service_client import Client
-from company_service_client.api.company import (
-    company_controller_insert_or_update,
-    company_controller_companies,
-)
-from company_service_client.models import InsertOrUpdateDto
-
-production = os.environ.get("PRODUCTION", False)
-url = os.environ.get("API_URL", "http://127.0.0.1:3000")
-
-client = Client(base_url=url, timeout=30.0, verify_ssl=production)
-
-# TODO: Insert scraping code here, and use the call outlined below to insert companies
-company_controller_insert_or_update.sync_detailed(
-    client=client,
-    json_body=[
-        InsertOrUpdateDto(
-            company_name="some company", country="DK", company_id="121212"
-        ),
-        InsertOrUpdateDto(
-            company_name="some other company", country="DK", company_id="454545"
-        ),
-    ],
-)
-
-print(f"Added companies:")
-print(company_controller_companies.sync_detailed(client=client).content)
+import asyncio
+import json
+import logging
+import tempfile
+from concurrent.futures import Executor
+from pathlib import Path
+from typing import AsyncIterable, Optional
+
+from company_service_client.models.create_company_dto import CreateCompanyDto
+
+from normative_batch_scrapers.governor import MemoryGovernor
+from normative_batch_scrapers.pipeline import UploaderSettings
+from normative_batch_scrapers.runner import RunnerSettings, ScraperRunner
+from normative_batch_scrapers.scraper.base import BatchScraper
+
+
+class ExampleScraper(BatchScraper):
+    name = "example"
+
+    async def download(
+        self, work_path: Path, governor: Optional[MemoryGovernor] = None
+    ) -> None:
+        # TODO: Insert scraping code here, storing the raw registry data in work_path
+        with open(work_path / "companies.json", mode="w") as f:
+            json.dump(
+                [
+                    dict(name="some company", id="121212"),
+                    dict(name="some other company", id="454545"),
+                ],
+                f,
+            )
+
+    async def transform(
+        self,
+        work_path: Path,
+        pool: Executor,
+        governor: Optional[MemoryGovernor] = None,
+    ) -> AsyncIterable[list[tuple[str, CreateCompanyDto]]]:
+        # TODO: Turn the raw data into companies, submit heavy lifting to the pool.
+        # The version is used to pick the latest record when a company is seen twice.
+        with open(work_path / "companies.json") as f:
+            companies = json.load(f)
+        yield [
+            (
+                "",
+                CreateCompanyDto(
+                    company_name=c["name"], country="DK", company_id=c["id"]
+                ),
+            )
+            for c in companies
+        ]
+
+
+async def main() -> None:
+    logging.basicConfig(level=logging.INFO)
+    with tempfile.TemporaryDirectory() as tdir:
+        runner = ScraperRunner(
+            [ExampleScraper()], UploaderSettings(), RunnerSettings(), Path(tdir)
+        )
+        print(await runner.run())
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
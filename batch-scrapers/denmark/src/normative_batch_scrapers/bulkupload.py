@@ -0,0 +1,259 @@
+# Copyright 2022 Meta Mind AB
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+from __future__ import annotations
+
+import asyncio
+import gzip
+import json
+import logging
+from concurrent.futures import Executor
+from dataclasses import dataclass
+from types import TracebackType
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    AsyncIterable,
+    Generic,
+    Iterable,
+    Optional,
+    Protocol,
+    Sequence,
+    Type,
+    TypeVar,
+)
+
+import httpx
+from pydantic import BaseSettings
+
+from normative_batch_scrapers.util import retry_async
+
+if TYPE_CHECKING:
+    from company_service_client import Client
+
+log = logging.getLogger(__name__)
+
+try:
+    import orjson
+
+    def _dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj)
+
+except ImportError:  # pragma: no cover - orjson is an optional speedup
+
+    def _dumps(obj: Any) -> bytes:
+        return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+
+class BodySettings(BaseSettings):
+    # NOTE: the company service must accept the chosen encodings, neither gzip
+    # nor NDJSON bodies are understood by a vanilla deployment.
+    gzip: bool = False
+    gzip_level: int = 6
+    ndjson: bool = False
+
+    class Config:
+        # GZIP on its own is read by gzip(1) as its default options
+        env_prefix = "UPLOAD_"
+
+
+class Dto(Protocol):
+    def to_dict(self) -> dict[str, Any]:
+        ...
+
+
+TDto = TypeVar("TDto", bound=Dto)
+
+
+@dataclass(frozen=True)
+class EncodedBody:
+    content: bytes
+    headers: dict[str, str]
+    nbr_of_records: int
+
+
+def encode_body(dtos: Sequence[Dto], settings: BodySettings) -> EncodedBody:
+    """
+    Serialize a batch of generated client models into a request body. This is
+    CPU bound and is intended to run in a worker thread or process.
+    """
+    records = [d.to_dict() for d in dtos]
+    if settings.ndjson:
+        content = b"".join(_dumps(r) + b"\n" for r in records)
+        headers = {"Content-Type": "application/x-ndjson"}
+    else:
+        content = _dumps(records)
+        headers = {"Content-Type": "application/json"}
+    if settings.gzip:
+        content = gzip.compress(content, compresslevel=settings.gzip_level)
+        headers["Content-Encoding"] = "gzip"
+    return EncodedBody(content=content, headers=headers, nbr_of_records=len(records))
+
+
+@dataclass
+class UploadResult(Generic[TDto]):
+    url: str
+    dtos: Sequence[TDto]
+    response: Optional[httpx.Response] = None
+    error: Optional[BaseException] = None
+
+    @property
+    def ok(self) -> bool:
+        return (
+            self.error is None
+            and self.response is not None
+            and self.response.is_success
+        )
+
+    @property
+    def status_code(self) -> Optional[int]:
+        return self.response.status_code if self.response is not None else None
+
+    def describe_error(self) -> str:
+        if self.response is not None and not self.response.is_success:
+            return f"{self.response.status_code}: {self.response.text[:1000]}"
+        return repr(self.error)
+
+
+def add_many_url(client: Client) -> str:
+    from company_service_client.api.company import company_controller_add_many
+
+    # let the generated client resolve the endpoint so that we follow the api spec
+    return company_controller_add_many._get_kwargs(client=client, json_body=[])["url"]
+
+
+class BulkUploader:
+    """
+    Upload batches of companies using pre-serialized, optionally compressed,
+    request bodies. Sits beside the generated client and reuses its
+    configuration, but keeps serialization off the event loop.
+    """
+
+    def __init__(
+        self,
+        client: Client,
+        settings: BodySettings,
+        executor: Optional[Executor] = None,
+        url: Optional[str] = None,
+        limits: Optional[httpx.Limits] = None,
+        nbr_of_retries: int = 0,
+        cooldown_in_ms: Optional[int] = None,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.client = client
+        self.settings = settings
+        self.executor = executor
+        self.nbr_of_retries = nbr_of_retries
+        self.cooldown_in_ms = cooldown_in_ms
+        self.url = url or add_many_url(client)
+        self._limits = limits or httpx.Limits()
+        self._transport = transport
+        self._http: Optional[httpx.AsyncClient] = None
+
+    async def __aenter__(self) -> BulkUploader:
+        self._http = httpx.AsyncClient(
+            headers=self.client.get_headers(),
+            cookies=self.client.get_cookies(),
+            timeout=self.client.get_timeout(),
+            verify=self.client.verify_ssl,
+            limits=self._limits,
+            transport=self._transport,
+        )
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc: Optional[BaseException],
+        tb: Optional[TracebackType],
+    ) -> None:
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+    async def check_health(self) -> bool:
+        if self._http is None:
+            raise RuntimeError("BulkUploader must be used as an async context manager")
+        try:
+            resp = await self._http.get(self.client.base_url)
+        except httpx.HTTPError:
+            log.debug(f"Health check of {self.client.base_url} failed", exc_info=True)
+            return False
+        return resp.is_success
+
+    async def encode(self, dtos: Sequence[Dto]) -> EncodedBody:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, encode_body, dtos, self.settings
+        )
+
+    async def post(self, body: EncodedBody) -> httpx.Response:
+        if self._http is None:
+            raise RuntimeError("BulkUploader must be used as an async context manager")
+        return await self._http.post(
+            self.url, content=body.content, headers=body.headers
+        )
+
+    async def _post_retryable(self, body: EncodedBody) -> httpx.Response:
+        resp = await self.post(body)
+        if resp.is_server_error:
+            resp.raise_for_status()
+        return resp
+
+    async def send(self, dtos: Sequence[TDto], body: EncodedBody) -> UploadResult[TDto]:
+        """
+        Post an encoded batch, retrying transport and server errors. Failures
+        are reported in the result rather than raised.
+        """
+        try:
+            resp = await retry_async(
+                self._post_retryable,
+                nbr_of_retries=self.nbr_of_retries,
+                cooldown_in_ms=self.cooldown_in_ms,
+            )(body)
+        except httpx.HTTPStatusError as e:
+            return UploadResult(
+                self.client.base_url, dtos, response=e.response, error=e
+            )
+        except httpx.HTTPError as e:
+            return UploadResult(self.client.base_url, dtos, error=e)
+        return UploadResult(self.client.base_url, dtos, response=resp)
+
+    async def upload(self, dtos: Sequence[TDto]) -> UploadResult[TDto]:
+        return await self.send(dtos, await self.encode(dtos))
+
+    async def upload_batches(
+        self, batches: Iterable[Sequence[TDto]]
+    ) -> AsyncIterable[UploadResult[TDto]]:
+        """
+        Upload batches in order while the next batch is serialized in the
+        background.
+        """
+        it = iter(batches)
+        if (first := next(it, None)) is None:
+            return
+        current = first
+        pending = asyncio.ensure_future(self.encode(current))
+        try:
+            while True:
+                body = await pending
+                if (nxt := next(it, None)) is not None:
+                    pending = asyncio.ensure_future(self.encode(nxt))
+                yield await self.send(current, body)
+                if nxt is None:
+                    return
+                current = nxt
+        finally:
+            if not pending.done():
+                pending.cancel()
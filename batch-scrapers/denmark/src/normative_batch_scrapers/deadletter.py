@@ -0,0 +1,78 @@
+# Copyright 2022 Meta Mind AB
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import json
+import logging
+import os
+import time
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Iterator, Optional
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class DeadLetter:
+    path: Path
+    status_code: Optional[int]
+    error: str
+    records: list[dict[str, Any]]
+
+
+class DeadLetterStore:
+    """
+    Persist batches that failed to upload, one json file per batch, so that
+    they can be replayed without rerunning the whole scrape.
+    """
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+
+    def put(
+        self, records: list[dict[str, Any]], status_code: Optional[int], error: str
+    ) -> Path:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # time ordered names so that batches are replayed in the order they failed
+        name = f"{time.time_ns()}-{uuid.uuid4().hex[:8]}.json"
+        path = self.directory / name
+        tmp = path.with_suffix(".tmp")
+        with open(tmp, mode="w") as f:
+            json.dump(dict(status_code=status_code, error=error, records=records), f)
+        os.replace(tmp, path)
+        log.debug(f"Dead lettered {len(records)} records to {path}")
+        return path
+
+    def _paths(self) -> list[Path]:
+        if not self.directory.is_dir():
+            return []
+        return sorted(p for p in self.directory.iterdir() if p.suffix == ".json")
+
+    def __iter__(self) -> Iterator[DeadLetter]:
+        for p in self._paths():
+            with open(p) as f:
+                d = json.load(f)
+            yield DeadLetter(
+                path=p,
+                status_code=d["status_code"],
+                error=d["error"],
+                records=d["records"],
+            )
+
+    def __len__(self) -> int:
+        return len(self._paths())
+
+    def remove(self, letter: DeadLetter) -> None:
+        letter.path.unlink(missing_ok=True)
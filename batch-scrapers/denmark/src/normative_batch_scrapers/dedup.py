@@ -0,0 +1,140 @@
+# Copyright 2022 Meta Mind AB
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+from pathlib import Path
+from types import TracebackType
+from typing import Any, Callable, Generic, Iterator, Optional, Type, TypeVar
+
+log = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+_CREATE_TABLE = "CREATE TABLE latest (key TEXT PRIMARY KEY, version TEXT, record TEXT)"
+
+# versions are compared as strings, ties go to the last written entry
+_UPSERT = """
+INSERT INTO latest (key, version, record) VALUES (?, ?, ?)
+ON CONFLICT (key) DO UPDATE SET version = excluded.version, record = excluded.record
+WHERE excluded.version >= latest.version
+"""
+
+
+class DedupIndex(Generic[T]):
+    """
+    Keep the latest version of every key. Entries are held in memory until
+    there are more than max_in_memory of them, at which point they are merged
+    into an sqlite database in directory.
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        to_record: Callable[[T], dict[str, Any]],
+        from_record: Callable[[dict[str, Any]], T],
+        max_in_memory: int = 100_000,
+    ):
+        self.directory = directory
+        self.to_record = to_record
+        self.from_record = from_record
+        self.max_in_memory = max_in_memory
+        self.nbr_of_added = 0
+        self._memory: dict[str, tuple[str, T]] = {}
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_path: Optional[Path] = None
+        self._iterating = False
+
+    def __enter__(self) -> "DedupIndex[T]":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc: Optional[BaseException],
+        tb: Optional[TracebackType],
+    ) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._memory.clear()
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+        if self._db_path is not None:
+            self._db_path.unlink(missing_ok=True)
+            self._db_path = None
+
+    def add(self, key: str, version: str, item: T) -> None:
+        self.nbr_of_added += 1
+        current = self._memory.get(key)
+        if current is None or version >= current[0]:
+            self._memory[key] = (version, item)
+        if len(self._memory) > self.max_in_memory:
+            self._spill()
+
+    def spill(self) -> None:
+        """
+        Move the entries held in memory to disk, e.g. when memory runs low.
+        Does nothing while the index is being iterated over.
+        """
+        if self._memory and not self._iterating:
+            log.info(f"Spilling {len(self._memory)} deduplicated entries to disk")
+            self._spill()
+
+    def _spill(self) -> None:
+        if self._db is None:
+            fd, path = tempfile.mkstemp(
+                prefix="dedup-", suffix=".sqlite", dir=self.directory
+            )
+            os.close(fd)
+            self._db_path = Path(path)
+            log.debug(f"Spilling deduplication index to {self._db_path}")
+            self._db = sqlite3.connect(self._db_path)
+            self._db.execute(_CREATE_TABLE)
+        self._db.executemany(
+            _UPSERT,
+            (
+                (key, version, json.dumps(self.to_record(item)))
+                for key, (version, item) in self._memory.items()
+            ),
+        )
+        self._db.commit()
+        self._memory.clear()
+
+    def __len__(self) -> int:
+        if self._db is None:
+            return len(self._memory)
+        self._spill()
+        (count,) = self._db.execute("SELECT COUNT(*) FROM latest").fetchone()
+        return count
+
+    @property
+    def nbr_of_duplicates(self) -> int:
+        return self.nbr_of_added - len(self)
+
+    def __iter__(self) -> Iterator[T]:
+        self._iterating = True
+        try:
+            if self._db is None:
+                yield from (item for _, item in self._memory.values())
+                return
+            self._spill()
+            for (record,) in self._db.execute("SELECT record FROM latest"):
+                yield self.from_record(json.loads(record))
+        finally:
+            self._iterating = False
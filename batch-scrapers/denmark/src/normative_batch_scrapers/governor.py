@@ -0,0 +1,260 @@
+# Copyright 2022 Meta Mind AB
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import asyncio
+import logging
+import os
+import time
+from collections import defaultdict
+from pathlib import Path
+from types import TracebackType
+from typing import AsyncIterable, Callable, Optional, Type, TypeVar
+
+from pydantic import BaseSettings, Field
+
+log = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+_MB = 1024 * 1024
+
+_PROC = Path("/proc")
+_CGROUP_LIMITS = [
+    Path("/sys/fs/cgroup/memory.max"),
+    Path("/sys/fs/cgroup/memory/memory.limit_in_bytes"),
+]
+
+
+class GovernorSettings(BaseSettings):
+    # watermarks default to fractions of the cgroup (i.e. pod) memory limit
+    soft_limit_mb: Optional[int] = Field(None, env="MEMORY_SOFT_LIMIT_MB")
+    hard_limit_mb: Optional[int] = Field(None, env="MEMORY_HARD_LIMIT_MB")
+    soft_limit_fraction: float = 0.7
+    hard_limit_fraction: float = 0.85
+    poll_interval_ms: int = 250
+    max_delay_ms: int = 1000
+    # longest a stage is paused above the hard watermark, after that it carries
+    # on at the slowest rate until memory drops below the soft watermark
+    max_pause_ms: int = 30_000
+
+
+def _rss(pid: int) -> int:
+    with open(_PROC / str(pid) / "statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def _children(pid: int) -> list[int]:
+    children: list[int] = []
+    for task in (_PROC / str(pid) / "task").iterdir():
+        with open(task / "children") as f:
+            children.extend(int(c) for c in f.read().split())
+    return children
+
+
+def process_tree_rss(pid: Optional[int] = None) -> Optional[int]:
+    """
+    Return the resident memory in bytes of a process and all its descendants,
+    e.g. process pool workers, or None if it can not be determined.
+    """
+    pids = [pid or os.getpid()]
+    total = 0
+    try:
+        while pids:
+            p = pids.pop()
+            try:
+                total += _rss(p)
+                pids.extend(_children(p))
+            except (FileNotFoundError, ProcessLookupError):
+                # the process exited while we were looking at it
+                continue
+    except OSError:
+        return None
+    return total
+
+
+def cgroup_memory_limit() -> Optional[int]:
+    for p in _CGROUP_LIMITS:
+        try:
+            raw = p.read_text().strip()
+        except OSError:
+            continue
+        # cgroup v1 reports a huge number when there is no limit
+        if raw != "max" and int(raw) < 2**60:
+            return int(raw)
+    return None
+
+
+class MemoryGovernor:
+    """
+    Throttle pipeline stages as the memory of the process tree approaches its
+    limit. Between the soft and hard watermark stages are slowed down in
+    proportion to the memory in use, above the hard watermark they are paused
+    until memory drops below the soft watermark again, or for at most
+    max_pause_ms. Crossing the hard watermark also fires the callbacks
+    registered with on_pressure. The time every stage spent throttled is kept
+    in throttled.
+    """
+
+    def __init__(
+        self,
+        settings: GovernorSettings,
+        rss: Callable[[], Optional[int]] = process_tree_rss,
+    ):
+        self.settings = settings
+        self.throttled: dict[str, float] = defaultdict(float)
+        self._read_rss = rss
+        self.soft_limit, self.hard_limit = self._watermarks()
+        self.rss = 0
+        self._monitor: Optional[asyncio.Task] = None
+        self._below_soft: Optional[asyncio.Event] = None
+        self._above_hard = False
+        self._on_pressure: list[Callable[[], None]] = []
+        # stages whose pause ran out while memory stayed high
+        self._unpaused: set[str] = set()
+
+    def _watermarks(self) -> tuple[Optional[int], Optional[int]]:
+        s = self.settings
+        limit = cgroup_memory_limit()
+        soft = s.soft_limit_mb * _MB if s.soft_limit_mb else None
+        hard = s.hard_limit_mb * _MB if s.hard_limit_mb else None
+        if limit is not None:
+            soft = soft or int(limit * s.soft_limit_fraction)
+            hard = hard or int(limit * s.hard_limit_fraction)
+        if soft is not None and hard is not None and soft >= hard:
+            raise ValueError("The soft memory limit must be below the hard limit")
+        return soft, hard
+
+    @property
+    def enabled(self) -> bool:
+        return self.soft_limit is not None and self.hard_limit is not None
+
+    async def __aenter__(self) -> "MemoryGovernor":
+        soft, hard = self.soft_limit, self.hard_limit
+        if soft is None or hard is None:
+            log.info("No memory limits found, memory governor is disabled")
+            return self
+        if self._read_rss() is None:
+            log.warning("Memory use can not be read, memory governor is disabled")
+            self.soft_limit = self.hard_limit = None
+            return self
+        log.info(f"Throttling above {soft // _MB} MiB, pausing above {hard // _MB} MiB")
+        self._below_soft = asyncio.Event()
+        self.sample()
+        self._monitor = asyncio.create_task(self._run_monitor())
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc: Optional[BaseException],
+        tb: Optional[TracebackType],
+    ) -> None:
+        if self._monitor is not None:
+            self._monitor.cancel()
+            self._monitor = None
+        if self.throttled:
+            log.info(
+                "Time throttled per stage: "
+                + ", ".join(f"{k} {v:.1f}s" for k, v in self.throttled.items())
+            )
+
+    def on_pressure(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """
+        Call callback whenever memory rises above the hard watermark, e.g. to
+        spill buffered data to disk. Returns a function removing the callback.
+        """
+        self._on_pressure.append(callback)
+        return lambda: self._on_pressure.remove(callback)
+
+    def sample(self) -> None:
+        assert self.soft_limit is not None and self.hard_limit is not None
+        assert self._below_soft is not None
+        self.rss = self._read_rss() or 0
+        if self.rss < self.soft_limit:
+            self._below_soft.set()
+            self._unpaused.clear()
+        else:
+            self._below_soft.clear()
+        above_hard = self.rss >= self.hard_limit
+        if above_hard and not self._above_hard:
+            log.info(f"{self.rss // _MB} MiB in use, releasing memory")
+            for callback in list(self._on_pressure):
+                try:
+                    callback()
+                except Exception:
+                    log.error("Failed to release memory", exc_info=True)
+        self._above_hard = above_hard
+
+    async def _run_monitor(self) -> None:
+        while True:
+            await asyncio.sleep(self.settings.poll_interval_ms / 1000)
+            self.sample()
+
+    async def throttle(self, stage: str, max_pause_ms: Optional[int] = None) -> None:
+        """
+        Wait before stage takes on more work if memory is running low. The
+        wait is capped at max_pause_ms when given, for stages that can not be
+        held for long, e.g. downloads that would lose their scroll.
+        """
+        if self.soft_limit is None or self.hard_limit is None:
+            return
+        if self.rss < self.soft_limit:
+            return
+        pause_ms = self.settings.max_pause_ms
+        if max_pause_ms is not None:
+            pause_ms = min(pause_ms, max_pause_ms)
+        start = time.monotonic()
+        if self.rss >= self.hard_limit and stage not in self._unpaused:
+            assert self._below_soft is not None
+            log.debug(f"Pausing {stage}, {self.rss // _MB} MiB in use")
+            try:
+                await asyncio.wait_for(self._below_soft.wait(), pause_ms / 1000)
+            except asyncio.TimeoutError:
+                log.warning(
+                    f"Paused {stage} for {pause_ms / 1000:.0f}s with "
+                    f"{self.rss // _MB} MiB still in use, resuming at the slowest rate"
+                )
+                self._unpaused.add(stage)
+        else:
+            fraction = min(
+                (self.rss - self.soft_limit) / (self.hard_limit - self.soft_limit), 1
+            )
+            delay_ms = min(fraction * self.settings.max_delay_ms, pause_ms)
+            await asyncio.sleep(delay_ms / 1000)
+        self.throttled[stage] += time.monotonic() - start
+
+
+async def governed(
+    ait: AsyncIterable[T],
+    governor: Optional[MemoryGovernor],
+    stage: str,
+    max_pause_ms: Optional[int] = None,
+) -> AsyncIterable[T]:
+    """
+    Throttle an asynchronous iterable before each item is requested. The
+    iterable is closed along with the governed one.
+    """
+    it = ait.__aiter__()
+    try:
+        while True:
+            if governor is not None:
+                await governor.throttle(stage, max_pause_ms)
+            try:
+                t = await it.__anext__()
+            except StopAsyncIteration:
+                return
+            yield t
+    finally:
+        if (aclose := getattr(it, "aclose", None)) is not None:
+            await aclose()
@@ -0,0 +1,120 @@
+# Copyright 2022 Meta Mind AB
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import asyncio
+import logging
+import os
+import queue
+import threading
+from pathlib import Path
+from types import TracebackType
+from typing import IO, Optional, Type
+
+log = logging.getLogger(__name__)
+
+
+class PageWriter:
+    """
+    Persist downloaded pages from a dedicated writer thread, so that disk
+    latency does not hold up the event loop. Pages are handed over through a
+    bounded queue and fsynced in batches of fsync_every files.
+    """
+
+    def __init__(self, directory: Path, queue_size: int = 8, fsync_every: int = 16):
+        self.directory = directory
+        self.fsync_every = fsync_every
+        self.nbr_of_pages = 0
+        self._queue: queue.Queue[Optional[tuple[str, str]]] = queue.Queue(queue_size)
+        self._error: Optional[BaseException] = None
+        self._thread = threading.Thread(
+            target=self._run, name="page-writer", daemon=True
+        )
+
+    def __enter__(self) -> "PageWriter":
+        self._thread.start()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc: Optional[BaseException],
+        tb: Optional[TracebackType],
+    ) -> None:
+        # None tells the writer thread to stop
+        self._queue.put(None)
+        self._thread.join()
+        if exc_type is None:
+            self._raise_on_error()
+
+    async def __aenter__(self) -> "PageWriter":
+        return self.__enter__()
+
+    async def __aexit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc: Optional[BaseException],
+        tb: Optional[TracebackType],
+    ) -> None:
+        # flushing the remaining pages may block, keep it off the event loop
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.__exit__, exc_type, exc, tb)
+
+    def _raise_on_error(self) -> None:
+        if self._error is not None:
+            raise IOError(f"Failed to write pages to {self.directory}") from self._error
+
+    async def write(self, name: str, content: str) -> None:
+        """Queue a page for writing, waiting only when the queue is full."""
+        self._raise_on_error()
+        try:
+            self._queue.put_nowait((name, content))
+        except queue.Full:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self._queue.put, (name, content))
+        self.nbr_of_pages += 1
+
+    def _run(self) -> None:
+        unsynced: list[IO[str]] = []
+        stopped = False
+        try:
+            while (item := self._queue.get()) is not None:
+                name, content = item
+                f = open(self.directory / name, mode="w")
+                unsynced.append(f)
+                f.write(content)
+                f.flush()
+                if len(unsynced) >= self.fsync_every:
+                    self._sync(unsynced)
+            stopped = True
+            self._sync(unsynced)
+        except BaseException as e:
+            log.error("Page writer failed", exc_info=True)
+            self._error = e
+            # drain the queue so that producers are never blocked
+            while not stopped and self._queue.get() is not None:
+                pass
+        finally:
+            for unsynced_file in unsynced:
+                unsynced_file.close()
+
+    def _sync(self, files: list[IO[str]]) -> None:
+        for f in files:
+            os.fsync(f.fileno())
+            f.close()
+        files.clear()
+        dir_fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
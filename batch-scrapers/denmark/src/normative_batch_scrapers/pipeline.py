@@ -0,0 +1,420 @@
+# Copyright 2022 Meta Mind AB
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+from __future__ import annotations
+
+import logging
+import tempfile
+from collections import deque
+from contextlib import ExitStack, contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    AsyncIterable,
+    Iterable,
+    Iterator,
+    Optional,
+    Sequence,
+)
+
+from pydantic import AnyHttpUrl, BaseSettings, Field, root_validator
+
+from normative_batch_scrapers.bulkupload import BodySettings, BulkUploader, UploadResult
+from normative_batch_scrapers.deadletter import DeadLetterStore
+from normative_batch_scrapers.governor import MemoryGovernor
+from normative_batch_scrapers.sharding import ShardedUploader
+from normative_batch_scrapers.util import RetrySettings, aenumerate, chunked
+
+# The generated client and the deduplication index are only needed by some of
+# the commands and are imported where they are used to keep the download
+# command and process pool workers light.
+if TYPE_CHECKING:
+    from company_service_client import Client
+    from company_service_client.models.create_company_dto import CreateCompanyDto
+
+    from normative_batch_scrapers.dedup import DedupIndex
+
+log = logging.getLogger(__name__)
+
+
+class UploaderSettings(BaseSettings):
+    api_url: Optional[AnyHttpUrl] = Field(None, env="API_URL")
+    # replica endpoints, when set companies are sharded over them by company id
+    api_urls: list[AnyHttpUrl] = Field(default_factory=list, env="API_URLS")
+    max_in_flight_per_endpoint: int = 2
+    # uploads a replay may spend on splitting one rejected batch
+    max_split_uploads: int = 100
+    health_check_interval: int = 10
+    verify_ssl: bool = Field(env="PRODUCTION", default=False)
+    batch_size: int = 1000
+    timeout: int = 30
+    body_settings: BodySettings = BodySettings()
+    retry_settings: RetrySettings = RetrySettings()
+
+    class Config:
+        env_file = ".env"
+        env_file_encoding = "utf-8"
+
+    @root_validator(skip_on_failure=True)
+    def _require_endpoint(cls, values: dict[str, Any]) -> dict[str, Any]:
+        if not values.get("api_url") and not values.get("api_urls"):
+            raise ValueError("Either API_URL or API_URLS must be set")
+        return values
+
+    @property
+    def endpoint_urls(self) -> list[str]:
+        """The replica urls when configured, otherwise the single api url."""
+        if self.api_urls:
+            return [str(url) for url in self.api_urls]
+        assert self.api_url is not None
+        return [str(self.api_url)]
+
+
+@dataclass
+class RunSummary:
+    nbr_of_companies: int = 0
+    nbr_of_duplicates: int = 0
+    nbr_of_failed_batches: int = 0
+    nbr_of_failed_companies: int = 0
+    nbr_of_replayed_companies: int = 0
+    # seconds every stage was held back by the memory governor, scrapers run by
+    # the batch runner share one governor so theirs are totals for the run
+    throttled_seconds: dict[str, float] = field(default_factory=dict)
+
+
+@contextmanager
+def company_index(
+    work_path: Path,
+    max_in_memory: int = 100_000,
+    governor: Optional[MemoryGovernor] = None,
+) -> Iterator[DedupIndex[CreateCompanyDto]]:
+    """
+    Return an index of the latest version of every company, keyed by
+    company_id, that spills to work_path when it grows beyond max_in_memory,
+    or when the governor reports memory above its hard watermark.
+    """
+    from company_service_client.models.create_company_dto import CreateCompanyDto
+
+    from normative_batch_scrapers.dedup import DedupIndex
+
+    with ExitStack() as stack:
+        index = stack.enter_context(
+            DedupIndex(
+                work_path,
+                to_record=CreateCompanyDto.to_dict,
+                from_record=CreateCompanyDto.from_dict,
+                max_in_memory=max_in_memory,
+            )
+        )
+        if governor is not None:
+            stack.callback(governor.on_pressure(index.spill))
+        yield index
+
+
+async def deduplicate(
+    chunks: AsyncIterable[Sequence[tuple[str, CreateCompanyDto]]],
+    index: DedupIndex[CreateCompanyDto],
+    summary: RunSummary,
+) -> None:
+    log.info("Deduplicate companies")
+    async for chunk in chunks:
+        for version, dto in chunk:
+            index.add(dto.company_id, version, dto)
+    summary.nbr_of_companies = len(index)
+    summary.nbr_of_duplicates = index.nbr_of_duplicates
+    log.info(
+        f"Extracted {summary.nbr_of_companies} companies, "
+        f"dropped {summary.nbr_of_duplicates} duplicates"
+    )
+
+
+def _make_client(upload_settings: UploaderSettings, url: str) -> Client:
+    from company_service_client import Client
+
+    return Client(
+        base_url=url,
+        verify_ssl=upload_settings.verify_ssl,
+        timeout=upload_settings.timeout,
+    )
+
+
+def _make_uploader(upload_settings: UploaderSettings, client: Client) -> BulkUploader:
+    return BulkUploader(
+        client,
+        upload_settings.body_settings,
+        nbr_of_retries=upload_settings.retry_settings.nbr_of_retries,
+        cooldown_in_ms=upload_settings.retry_settings.cooldown_in_ms,
+    )
+
+
+def dead_letter(
+    result: UploadResult[CreateCompanyDto],
+    dead_letters: DeadLetterStore,
+    summary: RunSummary,
+) -> None:
+    log.warning(
+        f"Upload of {len(result.dtos)} companies to {result.url} failed: "
+        f"{result.describe_error()}"
+    )
+    dead_letters.put(
+        [d.to_dict() for d in result.dtos],
+        status_code=result.status_code,
+        error=result.describe_error(),
+    )
+    summary.nbr_of_failed_batches += 1
+    summary.nbr_of_failed_companies += len(result.dtos)
+
+
+async def _upload_single(
+    upload_settings: UploaderSettings,
+    batches: Iterable[list[CreateCompanyDto]],
+    dead_letters: DeadLetterStore,
+    summary: RunSummary,
+    governor: Optional[MemoryGovernor],
+) -> None:
+    [url] = upload_settings.endpoint_urls
+    client = _make_client(upload_settings, url)
+    async with _make_uploader(upload_settings, client) as uploader:
+        async for i, result in aenumerate(uploader.upload_batches(batches)):
+            if i % 10 == 0:
+                log.debug(f"Uploaded batch {i}")
+            if not result.ok:
+                dead_letter(result, dead_letters, summary)
+            if governor is not None:
+                await governor.throttle("upload")
+
+
+def make_sharded_uploader(
+    upload_settings: UploaderSettings,
+) -> ShardedUploader[CreateCompanyDto]:
+    return ShardedUploader(
+        [_make_client(upload_settings, url) for url in upload_settings.endpoint_urls],
+        upload_settings.body_settings,
+        key=lambda d: d.company_id,
+        max_in_flight=upload_settings.max_in_flight_per_endpoint,
+        health_check_interval=upload_settings.health_check_interval,
+        nbr_of_retries=upload_settings.retry_settings.nbr_of_retries,
+        cooldown_in_ms=upload_settings.retry_settings.cooldown_in_ms,
+    )
+
+
+async def _upload_sharded(
+    upload_settings: UploaderSettings,
+    batches: Iterable[list[CreateCompanyDto]],
+    dead_letters: DeadLetterStore,
+    summary: RunSummary,
+    governor: Optional[MemoryGovernor],
+) -> None:
+    uploader = make_sharded_uploader(upload_settings)
+
+    def collect(results: list[UploadResult[CreateCompanyDto]]) -> None:
+        for r in results:
+            if not r.ok:
+                dead_letter(r, dead_letters, summary)
+
+    async with uploader:
+        for i, b in enumerate(batches):
+            if i % 10 == 0:
+                log.debug(f"Uploading batch {i}")
+            await uploader.submit(b)
+            collect(uploader.harvest())
+            if governor is not None:
+                await governor.throttle("upload")
+        await uploader.drain()
+        collect(uploader.harvest())
+    collect(uploader.harvest())
+
+
+async def upload(
+    upload_settings: UploaderSettings,
+    dtos: Iterable[CreateCompanyDto],
+    dead_letters: DeadLetterStore,
+    summary: RunSummary,
+    governor: Optional[MemoryGovernor] = None,
+) -> None:
+    """
+    Upload companies in batches, batches that fail are dead lettered. When a
+    governor is given it is consulted before the next batch is assembled.
+    """
+    log.info("Upload companies to server")
+    # TODO: tune batch size
+    batches = chunked(dtos, n=upload_settings.batch_size)
+    if upload_settings.api_urls:
+        await _upload_sharded(upload_settings, batches, dead_letters, summary, governor)
+    else:
+        await _upload_single(upload_settings, batches, dead_letters, summary, governor)
+    if summary.nbr_of_failed_batches:
+        log.warning(
+            f"{summary.nbr_of_failed_batches} batches failed to upload "
+            f"and were written to {dead_letters.directory}"
+        )
+
+
+# statuses that say nothing about the records in a batch: authentication,
+# timeouts, rate limiting and a gateway in front of an unavailable service
+_UNAVAILABLE = {401, 403, 407, 408, 429, 502, 503, 504}
+
+
+def _is_rejection(result: UploadResult[CreateCompanyDto]) -> bool:
+    """
+    Whether the company service refused records of the batch, rather than
+    being unreachable. Only then can splitting the batch isolate them.
+    """
+    resp = result.response
+    if resp is None or resp.status_code in _UNAVAILABLE:
+        return False
+    if resp.status_code == 500:
+        # the service reports its own errors as json, unlike a proxy in front of it
+        return resp.headers.get("content-type", "").startswith("application/json")
+    return resp.is_client_error
+
+
+class _ReplayStopped(Exception):
+    def __init__(self, result: UploadResult[CreateCompanyDto]):
+        super().__init__(result.describe_error())
+        self.result = result
+
+
+async def _isolate_rejected(
+    uploader: ShardedUploader[CreateCompanyDto],
+    rejected: list[UploadResult[CreateCompanyDto]],
+    max_uploads: int,
+) -> list[UploadResult[CreateCompanyDto]]:
+    """
+    Split rejected batches in halves, down to single records, until the
+    records the company service refuses are isolated, and return the failed
+    results of those. After max_uploads the batches still rejected are
+    returned as they are. Raises _ReplayStopped when the service becomes
+    unavailable.
+    """
+    isolated = []
+    pending = deque(rejected)
+    uploads = 0
+    while pending:
+        failed = pending.popleft()
+        if len(failed.dtos) == 1:
+            isolated.append(failed)
+            continue
+        if uploads + 2 > max_uploads:
+            log.warning(
+                f"Keeping {len(failed.dtos)} companies rejected with "
+                f"{failed.describe_error()}, out of uploads to split them"
+            )
+            isolated.append(failed)
+            continue
+        mid = len(failed.dtos) // 2
+        for half in (failed.dtos[:mid], failed.dtos[mid:]):
+            uploads += 1
+            for result in await uploader.upload(half):
+                if result.ok:
+                    continue
+                if not _is_rejection(result):
+                    raise _ReplayStopped(result)
+                pending.append(result)
+    return isolated
+
+
+async def _replay_letter(
+    uploader: ShardedUploader[CreateCompanyDto],
+    dtos: list[CreateCompanyDto],
+    max_split_uploads: int,
+) -> list[UploadResult[CreateCompanyDto]]:
+    """Resend a dead lettered batch, returning the records still refused."""
+    rejected = []
+    for result in await uploader.upload(dtos):
+        if result.ok:
+            continue
+        if not _is_rejection(result):
+            raise _ReplayStopped(result)
+        rejected.append(result)
+    return await _isolate_rejected(uploader, rejected, max_split_uploads)
+
+
+async def _replay_letters(
+    uploader: ShardedUploader[CreateCompanyDto],
+    dead_letters: DeadLetterStore,
+    summary: RunSummary,
+    max_split_uploads: int = 100,
+) -> None:
+    from company_service_client.models.create_company_dto import CreateCompanyDto
+
+    letters = list(dead_letters)
+    log.info(f"Replay {len(letters)} dead lettered batches")
+    for i, letter in enumerate(letters):
+        dtos = [CreateCompanyDto.from_dict(r) for r in letter.records]
+        try:
+            rejected = await _replay_letter(uploader, dtos, max_split_uploads)
+        except _ReplayStopped as e:
+            # the letter is kept as is, its records may have been partially sent
+            # but upserts are idempotent, so it can be replayed again later
+            summary.nbr_of_failed_batches += 1
+            summary.nbr_of_failed_companies += len(dtos)
+            log.error(
+                f"Company service unavailable, stopping replay with "
+                f"{len(letters) - i} batches left: {e}"
+            )
+            for rest in letters[i + 1 :]:
+                summary.nbr_of_failed_batches += 1
+                summary.nbr_of_failed_companies += len(rest.records)
+            return
+        for r in rejected:
+            dead_letter(r, dead_letters, summary)
+        summary.nbr_of_replayed_companies += len(dtos) - sum(
+            len(r.dtos) for r in rejected
+        )
+        dead_letters.remove(letter)
+
+
+async def replay(
+    upload_settings: UploaderSettings,
+    dead_letters: DeadLetterStore,
+    summary: RunSummary,
+) -> None:
+    """
+    Resend dead lettered batches, routed to the replicas the same way as the
+    upload. Batches the company service rejects are split to dead letter only
+    the records it refuses. Replay stops, leaving the remaining batches as they
+    are, when the company service is unavailable.
+    """
+    async with make_sharded_uploader(upload_settings) as uploader:
+        await _replay_letters(
+            uploader, dead_letters, summary, upload_settings.max_split_uploads
+        )
+    log.info(
+        f"Replayed {summary.nbr_of_replayed_companies} companies, "
+        f"{summary.nbr_of_failed_companies} companies still failing"
+    )
+
+
+def dead_letter_store(work_path: Path) -> DeadLetterStore:
+    return DeadLetterStore(work_path / "dead-letters")
+
+
+@contextmanager
+def target_directory(directory: Optional[Path]) -> Iterator[Path]:
+    """
+    Return a path resource to a valid storage directory. If no explicit path is
+    supplied a path to a temporary directory is returned.
+    """
+    if directory:
+        log.info(f"Using {directory.absolute()} for storage")
+        if not directory.is_dir():
+            raise IOError(f"Supplied path {directory} is not a valid directory")
+        yield directory
+    else:
+        log.info("Using temporary directory for storage")
+        with tempfile.TemporaryDirectory() as tdir:
+            yield Path(tdir)
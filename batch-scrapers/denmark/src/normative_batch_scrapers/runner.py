@@ -0,0 +1,200 @@
+# Copyright 2022 Meta Mind AB
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import time
+import uuid
+from concurrent.futures import Executor, ProcessPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional, Sequence
+
+from pydantic import BaseSettings
+
+from normative_batch_scrapers.governor import GovernorSettings, MemoryGovernor
+from normative_batch_scrapers.pipeline import (
+    RunSummary,
+    UploaderSettings,
+    company_index,
+    dead_letter,
+    dead_letter_store,
+    deduplicate,
+    make_sharded_uploader,
+)
+from normative_batch_scrapers.scraper.base import BatchScraper
+from normative_batch_scrapers.sharding import ShardedUploader
+from normative_batch_scrapers.util import chunked
+
+if TYPE_CHECKING:
+    from company_service_client.models.create_company_dto import CreateCompanyDto
+
+    from normative_batch_scrapers.bulkupload import UploadResult
+
+log = logging.getLogger(__name__)
+
+
+class RunnerSettings(BaseSettings):
+    max_concurrent_scrapers: int = 2
+    max_concurrent_downloads: int = 2
+    # size of the process pool shared by all scrapers, defaults to the cpu count
+    max_transform_workers: Optional[int] = None
+    max_companies_in_memory: int = 100_000
+    governor_settings: GovernorSettings = GovernorSettings()
+
+
+class RunnerState:
+    """Time of the last successful run of every scraper."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.last_success: dict[str, float] = {}
+        if path.exists():
+            with open(path) as f:
+                self.last_success = json.load(f)["last_success"]
+
+    def record_success(self, name: str, when: float) -> None:
+        self.last_success[name] = when
+
+    def save(self) -> None:
+        tmp = self.path.with_suffix(".tmp")
+        with open(tmp, mode="w") as f:
+            json.dump(dict(last_success=self.last_success), f)
+        tmp.replace(self.path)
+
+
+def schedule(
+    scrapers: Sequence[BatchScraper], state: RunnerState
+) -> list[BatchScraper]:
+    """
+    Order scrapers by priority and then by freshness, scrapers that never
+    succeeded first followed by the ones whose data is the most stale.
+    """
+    return sorted(
+        scrapers, key=lambda s: (-s.priority, state.last_success.get(s.name, 0.0))
+    )
+
+
+class ScraperRunner:
+    """
+    Run several country scrapers concurrently. The scrapers share one process
+    pool for transformation and one uploader, so the global concurrency limits
+    hold regardless of how many countries are scraped.
+    """
+
+    def __init__(
+        self,
+        scrapers: Sequence[BatchScraper],
+        upload_settings: UploaderSettings,
+        runner_settings: RunnerSettings,
+        work_path: Path,
+    ):
+        if len({s.name for s in scrapers}) != len(scrapers):
+            raise ValueError("Scraper names must be unique")
+        self.scrapers = scrapers
+        self.upload_settings = upload_settings
+        self.runner_settings = runner_settings
+        self.work_path = work_path
+
+    async def run(self) -> dict[str, RunSummary]:
+        state = RunnerState(self.work_path / "runner-state.json")
+        order = schedule(self.scrapers, state)
+        log.info(f"Running scrapers {', '.join(s.name for s in order)}")
+        # time ordered, and unique when runs start within the same second
+        timestamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+        run_id = f"{timestamp}-{uuid.uuid4().hex[:8]}"
+        summaries = {s.name: RunSummary() for s in order}
+        # semaphores wake waiters in fifo order, so scrapers start in schedule order
+        settings = self.runner_settings
+        scraper_slots = asyncio.Semaphore(settings.max_concurrent_scrapers)
+        download_slots = asyncio.Semaphore(settings.max_concurrent_downloads)
+
+        # one governor for all scrapers, memory is a shared resource
+        governor = MemoryGovernor(settings.governor_settings)
+
+        async def run_one(
+            scraper: BatchScraper,
+            pool: Executor,
+            uploader: ShardedUploader[CreateCompanyDto],
+        ) -> None:
+            async with scraper_slots:
+                work_path = self.work_path / scraper.name / run_id
+                work_path.mkdir(parents=True)
+                log.info(f"Starting scraper {scraper.name} in {work_path}")
+                async with download_slots:
+                    await scraper.download(work_path, governor)
+                await self._transform_and_upload(
+                    scraper,
+                    work_path,
+                    pool,
+                    uploader,
+                    governor,
+                    summaries[scraper.name],
+                )
+
+        with ProcessPoolExecutor(settings.max_transform_workers) as pool:
+            async with governor:
+                async with make_sharded_uploader(self.upload_settings) as uploader:
+                    results = await asyncio.gather(
+                        *(run_one(s, pool, uploader) for s in order),
+                        return_exceptions=True,
+                    )
+
+        for scraper, result in zip(order, results):
+            summary = summaries[scraper.name]
+            summary.throttled_seconds = dict(governor.throttled)
+            if isinstance(result, BaseException):
+                log.error(f"Scraper {scraper.name} failed", exc_info=result)
+            elif summary.nbr_of_failed_batches:
+                # its data did not reach the company service, keep it stale
+                log.warning(
+                    f"Scraper {scraper.name} failed to upload "
+                    f"{summary.nbr_of_failed_batches} batches"
+                )
+            else:
+                state.record_success(scraper.name, time.time())
+            log.info(f"Run summary {scraper.name}: {summary}")
+        state.save()
+        return summaries
+
+    async def _transform_and_upload(
+        self,
+        scraper: BatchScraper,
+        work_path: Path,
+        pool: Executor,
+        uploader: ShardedUploader[CreateCompanyDto],
+        governor: MemoryGovernor,
+        summary: RunSummary,
+    ) -> None:
+        dead_letters = dead_letter_store(work_path)
+
+        def on_result(result: UploadResult[CreateCompanyDto]) -> None:
+            if not result.ok:
+                dead_letter(result, dead_letters, summary)
+
+        max_in_memory = self.runner_settings.max_companies_in_memory
+        with company_index(work_path, max_in_memory, governor) as index:
+            chunks = scraper.transform(work_path, pool, governor)
+            await deduplicate(chunks, index, summary)
+            # only uploads in flight are kept, the uploader bounds how many
+            pending: set[asyncio.Task] = set()
+            for b in chunked(index, n=self.upload_settings.batch_size):
+                for task in await uploader.submit(b, on_result=on_result):
+                    pending.add(task)
+                    task.add_done_callback(pending.discard)
+                await governor.throttle("upload")
+            await asyncio.gather(*pending)
@@ -0,0 +1,63 @@
+# Copyright 2022 Meta Mind AB
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+from __future__ import annotations
+
+from abc import ABC, abstractmethod
+from concurrent.futures import Executor
+from pathlib import Path
+from typing import TYPE_CHECKING, AsyncIterable, Optional, Sequence
+
+from normative_batch_scrapers.governor import MemoryGovernor
+
+if TYPE_CHECKING:
+    from company_service_client.models.create_company_dto import CreateCompanyDto
+
+
+class BatchScraper(ABC):
+    """
+    A scraper for one company registry. A scraper downloads raw registry data
+    to a work directory and transforms it into companies, the runner takes care
+    of deduplication and upload.
+    """
+
+    # unique name, used for work directories and scheduling state
+    name: str
+    # scrapers with a higher priority are scheduled first
+    priority: int = 0
+
+    @abstractmethod
+    async def download(
+        self, work_path: Path, governor: Optional[MemoryGovernor] = None
+    ) -> None:
+        """
+        Download raw registry data to work_path. When a governor is given
+        governor.throttle("download") should be awaited before every request.
+        """
+        ...
+
+    @abstractmethod
+    def transform(
+        self,
+        work_path: Path,
+        pool: Executor,
+        governor: Optional[MemoryGovernor] = None,
+    ) -> AsyncIterable[Sequence[tuple[str, CreateCompanyDto]]]:
+        """
+        Yield chunks of (version, company) pairs. When a company is produced
+        more than once only the one with the greatest version is uploaded.
+        CPU bound work should be submitted to pool, awaiting
+        governor.throttle("transform") before every submission.
+        """
+        ...
@@ -12,10 +12,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 #
+import json
 from dataclasses import dataclass
 from typing import Mapping, Optional
 
-from black import json
 from pydantic import BaseModel, parse_obj_as
 
 # TODO: generate these files to a better location
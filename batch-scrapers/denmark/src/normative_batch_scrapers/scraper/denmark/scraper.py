@@ -12,20 +12,19 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 #
+from __future__ import annotations
+
 import asyncio
-import itertools
 import logging
-import tempfile
-from concurrent.futures import ProcessPoolExecutor
-from contextlib import contextmanager
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor
+from contextlib import ExitStack
 from pathlib import Path
-from typing import Iterator, Optional
-
-from company_service_client import Client
-from company_service_client.api.company import company_controller_add_many
-from company_service_client.models.create_company_dto import CreateCompanyDto
-from pydantic import BaseSettings, Field, HttpUrl
+from typing import TYPE_CHECKING, AsyncIterable, Optional
 
+from normative_batch_scrapers.governor import MemoryGovernor, governed
+from normative_batch_scrapers.pagewriter import PageWriter
+from normative_batch_scrapers.scraper.base import BatchScraper
 from normative_batch_scrapers.scraper.denmark.response_parser import (
     parse_denmark_response,
 )
@@ -33,91 +32,114 @@ from normative_batch_scrapers.scraper.denmark.scrolldownloader import (
     DownloaderSettings,
     scroll,
 )
-from normative_batch_scrapers.scraper.denmark.transformer import (
-    create_company_transformer,
-)
-from normative_batch_scrapers.util import aenumerate, batch
+from normative_batch_scrapers.util import aenumerate, amerge
 
-log = logging.getLogger(__name__)
+# The generated client and the transformer are only needed by the transform
+# stage and are imported where they are used to keep the download command and
+# process pool workers light.
+if TYPE_CHECKING:
+    from company_service_client.models.create_company_dto import CreateCompanyDto
 
+    from normative_batch_scrapers.scraper.denmark.transformer import Version
 
-class UploaderSettings(BaseSettings):
-    api_url: HttpUrl = Field(..., env="API_URL")
-    verify_ssl: bool = Field(env="PRODUCTION", default=False)
-    batch_size: int = 1000
-    timeout: int = 30
-
-    class Config:
-        env_file = ".env"
-        env_file_encoding = "utf-8"
+log = logging.getLogger(__name__)
 
 
-async def download_stream(settings: DownloaderSettings, write_path: Path):
+async def download_stream(
+    settings: DownloaderSettings,
+    write_path: Path,
+    governor: Optional[MemoryGovernor] = None,
+):
     log.info(f"Download raw stream to local storage")
     if any(write_path.iterdir()):
         raise IOError(f"Download directory {write_path} is not empty")
-    async for i, rawresp in aenumerate(scroll(settings, raw=True)):
-        if i % 10 == 0:
-            log.debug(f"Writing scollbatch {i}")
-        p = write_path / f"{i}.json"
-        with open(p, mode="w") as f:
-            f.write(rawresp)
-
+    if settings.scroll_slices > 1:
+        scrolls = [
+            scroll(settings, raw=True, slice_id=i)
+            for i in range(settings.scroll_slices)
+        ]
+    else:
+        scrolls = [scroll(settings, raw=True)]
+    writer = PageWriter(
+        write_path,
+        queue_size=settings.write_queue_size,
+        fsync_every=settings.fsync_every,
+    )
+    async with writer:
+        # the governor holds back the next page request of every scroll, but
+        # never for long enough to let the scroll expire
+        max_pause_ms = settings.scroll_timeout * 60_000 // 2
+        pages = amerge(
+            [governed(s, governor, "download", max_pause_ms) for s in scrolls],
+            maxsize=settings.read_ahead,
+        )
+        async for i, rawresp in aenumerate(pages):
+            if i % 10 == 0:
+                log.debug(f"Writing scollbatch {i}")
+            await writer.write(f"{i}.json", rawresp)
+
+
+def _transform_file(p: Path) -> list[tuple[Version, CreateCompanyDto]]:
+    from normative_batch_scrapers.scraper.denmark.transformer import (
+        create_company_transformer,
+    )
 
-def _transform_file(p: Path) -> list[CreateCompanyDto]:
     transformer = create_company_transformer()
     with open(p) as f:
         parsed_response = parse_denmark_response(f.read())
-    return list(transformer.transform(parsed_response))
+    return list(transformer.transform_versioned(parsed_response))
 
 
-async def transform(read_path: Path) -> list[CreateCompanyDto]:
+async def transform(
+    read_path: Path,
+    pool: Optional[Executor] = None,
+    governor: Optional[MemoryGovernor] = None,
+    max_pending: Optional[int] = None,
+) -> AsyncIterable[list[tuple[Version, CreateCompanyDto]]]:
     log.info("Explode responses into companies")
     files = [p for p in read_path.iterdir() if p.suffix == ".json"]
     nbr_of_files = len(files)
-    chunks = []
-    with ProcessPoolExecutor() as pool:
-        tasks = [asyncio.wrap_future(pool.submit(_transform_file, f)) for f in files]
-        for i, t in enumerate(asyncio.as_completed(tasks)):
-            if i % 100 == 0:
-                log.debug(f"Processed response {i}/{nbr_of_files}")
-            chunk = await t
-            chunks.append(chunk)
-    companies = list(itertools.chain(*chunks))
-    log.info(f"Extracted {len(companies)} companies")
-    return companies
-
-
-async def upload(
-    upload_settings: UploaderSettings, dtos: list[CreateCompanyDto]
-) -> None:
-    log.info("Upload companies to server")
-    client = Client(
-        base_url=upload_settings.api_url,
-        verify_ssl=upload_settings.verify_ssl,
-        timeout=upload_settings.timeout,
-    )
-
-    # TODO: tune batch size and try limited concurrent uploads
-    nbr_of_batches = len(dtos) // upload_settings.batch_size
-    for i, b in enumerate(batch(dtos, n=upload_settings.batch_size)):
-        if i % 10 == 0:
-            log.debug(f"Uploading batch {i}/{nbr_of_batches}")
-        await company_controller_add_many.asyncio_detailed(client=client, json_body=b)
-
-
-@contextmanager
-def target_directory(directory: Optional[Path]) -> Iterator[Path]:
-    """
-    Return a path resource to a valid storage directory. If no explicit path is
-    supplied a path to a temporary directory is returned.
-    """
-    if directory:
-        log.info(f"Using {directory.absolute()} for storage")
-        if not directory.is_dir():
-            raise IOError(f"Supplied path {directory} is not a valid directory")
-        yield directory
-    else:
-        log.info("Using temporary directory for storage")
-        with tempfile.TemporaryDirectory() as tdir:
-            yield Path(tdir)
+    # files are dispatched as workers free up rather than all at once, so that
+    # finished chunks do not pile up and the governor can hold back new work
+    max_pending = max_pending or 2 * (os.cpu_count() or 1)
+    pending: set[asyncio.Future[list[tuple[Version, CreateCompanyDto]]]] = set()
+    i = 0
+    with ExitStack() as stack:
+        if pool is None:
+            pool = stack.enter_context(ProcessPoolExecutor())
+        while files or pending:
+            while files and len(pending) < max_pending:
+                if governor is not None:
+                    await governor.throttle("transform")
+                future = pool.submit(_transform_file, files.pop())
+                pending.add(asyncio.wrap_future(future))
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for t in done:
+                if i % 100 == 0:
+                    log.debug(f"Processed response {i}/{nbr_of_files}")
+                i += 1
+                yield t.result()
+
+
+class DenmarkScraper(BatchScraper):
+    """Scrapes the Virk CVR registry of companies in Denmark."""
+
+    name = "denmark"
+
+    def __init__(self, settings: Optional[DownloaderSettings] = None):
+        self.settings = settings or DownloaderSettings()
+
+    async def download(
+        self, work_path: Path, governor: Optional[MemoryGovernor] = None
+    ) -> None:
+        await download_stream(self.settings, write_path=work_path, governor=governor)
+
+    def transform(
+        self,
+        work_path: Path,
+        pool: Executor,
+        governor: Optional[MemoryGovernor] = None,
+    ) -> AsyncIterable[list[tuple[Version, CreateCompanyDto]]]:
+        return transform(work_path, pool, governor=governor)
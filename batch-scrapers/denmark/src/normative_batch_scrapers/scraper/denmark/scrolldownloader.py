@@ -25,22 +25,24 @@ from normative_batch_scrapers.scraper.denmark.response_parser import (
     ParsedResponse,
     ScrollId,
 )
-from normative_batch_scrapers.util import retry_async
+from normative_batch_scrapers.util import RetrySettings, retry_async
 
 log = logging.getLogger(__name__)
 
 
-class RetrySettings(BaseSettings):
-    nbr_of_retries: int = 3
-    cooldown_in_ms: int = 50
-
-
 class DownloaderSettings(BaseSettings):
     username: SecretStr = Field(..., env="DK_VIRK_USERNAME")
     password: SecretStr = Field(..., env="DK_VIRK_PASSWORD")
     scroll_page_size: int = 2000
     scroll_timeout: int = 1
+    # nbr of scroll pages to download, shared evenly by the slices
     scroll_limit: Optional[int] = None
+    # nbr of sliced scrolls to download in parallel, i.e. requests outstanding
+    scroll_slices: int = 1
+    # nbr of downloaded pages buffered ahead of the writer
+    read_ahead: int = 4
+    write_queue_size: int = 8
+    fsync_every: int = 16
     retry_settings: RetrySettings = RetrySettings()
 
     class Config:
@@ -63,11 +65,15 @@ def _build_subsequent_scroll_url(scroll_timeout: int, scroll_id: str) -> str:
     return urljoin(_BASE_URL, path + query)
 
 
-def _build_initial_request(batch_size: int) -> dict:
-    d = {
+def _build_initial_request(
+    batch_size: int, slice_id: Optional[int] = None, max_slices: int = 1
+) -> dict:
+    d: dict = {
         "query": {"match_all": {}},
         "size": batch_size,
     }
+    if slice_id is not None:
+        d["slice"] = {"id": slice_id, "max": max_slices}
     return d
 
 
@@ -96,9 +102,12 @@ async def _fetch_next_scroll_page(
 async def _initiate_scroll_download(
     client: httpx.AsyncClient,
     settings: DownloaderSettings,
+    slice_id: Optional[int] = None,
 ) -> tuple[ScrollId, RawResponse, ParsedResponse]:
     url = _build_initial_url(settings)
-    data = _build_initial_request(settings.scroll_page_size)
+    data = _build_initial_request(
+        settings.scroll_page_size, slice_id, settings.scroll_slices
+    )
     resp = await retry_async(
         client.post,
         nbr_of_retries=settings.retry_settings.nbr_of_retries,
@@ -115,37 +124,55 @@ async def _initiate_scroll_download(
     return pr.scroll_id, RawResponse(resp.text), pr
 
 
+def _slice_scroll_limit(
+    settings: DownloaderSettings, slice_id: Optional[int]
+) -> Optional[int]:
+    if settings.scroll_limit is None or slice_id is None:
+        return settings.scroll_limit
+    # round up, so that every slice downloads at least one page
+    return -(-settings.scroll_limit // settings.scroll_slices)
+
+
 @overload
 def scroll(
-    settings: DownloaderSettings, raw: Literal[True]
+    settings: DownloaderSettings, raw: Literal[True], slice_id: Optional[int] = None
 ) -> AsyncIterable[RawResponse]:
     ...
 
 
 @overload
 def scroll(
-    settings: DownloaderSettings, raw: Literal[False]
+    settings: DownloaderSettings, raw: Literal[False], slice_id: Optional[int] = None
 ) -> AsyncIterable[ParsedResponse]:
     ...
 
 
 async def scroll(
-    settings: DownloaderSettings, raw: Literal[True, False] = False
+    settings: DownloaderSettings,
+    raw: Literal[True, False] = False,
+    slice_id: Optional[int] = None,
 ) -> Union[AsyncIterable[RawResponse], AsyncIterable[ParsedResponse]]:
+    """
+    Scroll through all companies. When slice_id is given only that slice, out
+    of settings.scroll_slices, is scrolled, allowing slices to be downloaded in
+    parallel.
+    """
     async with httpx.AsyncClient() as client:
         i = 0
         scroll_id, initial_raw_resp, initial_resp = await _initiate_scroll_download(
-            client, settings
+            client, settings, slice_id
         )
         yield initial_raw_resp if raw else initial_resp
         i += 1
         last_resp = initial_resp
 
+        scroll_limit = _slice_scroll_limit(settings, slice_id)
+
         def over_scroll_limit(i: int) -> bool:
-            if settings.scroll_limit is None:
+            if scroll_limit is None:
                 return False
             else:
-                return i > settings.scroll_limit
+                return i > scroll_limit
 
         while not last_resp.is_empty() and not over_scroll_limit(i):
             scroll_id, next_raw_resp, next_resp = await _fetch_next_scroll_page(
@@ -13,12 +13,9 @@
 # limitations under the License.
 #
 import logging
-import operator
 from dataclasses import dataclass
-from http.client import responses
-from pydoc import visiblename
-from tkinter.font import names
-from typing import AsyncIterable, Iterable, Mapping, Optional
+from datetime import date
+from typing import Iterable, Mapping, NewType, Optional
 
 from company_service_client.models.create_company_dto import CreateCompanyDto
 
@@ -28,13 +25,14 @@ from normative_batch_scrapers.scraper.denmark.classification_mappings import (
     make_mappings,
 )
 from normative_batch_scrapers.scraper.denmark.response_parser import (
-    Hit,
     ParsedResponse,
     Vrvirksomhed,
 )
 
 log = logging.getLogger(__name__)
 
+Version = NewType("Version", str)
+
 
 def _extract_name(virksomhed: Vrvirksomhed) -> Optional[str]:
     names_by_valid_to = sorted(
@@ -58,6 +56,21 @@ def _extract_localized_sic(company: Vrvirksomhed) -> Optional[DkSic]:
     return DkSic(dksic_by_valid_to[0].branchekode)
 
 
+def _extract_version(company: Vrvirksomhed) -> Version:
+    """
+    Order records of the same company by the date of the last change to its
+    names and main branches, i.e. the latest start or end of any of their
+    validity periods. An open ended period has not changed since it started,
+    so a record where it has been closed, e.g. when the company is dissolved,
+    is the newer one.
+    """
+    periods = [n.periode for n in company.navne] + [
+        b.periode for b in company.hovedbranche
+    ]
+    changes = [d for p in periods for d in (p.gyldig_fra, p.gyldig_til) if d]
+    return Version(max(changes, default=date.min).isoformat())
+
+
 @dataclass
 class CompanyTransformer:
     classification_mappings: Mapping[DkSic, Classification]
@@ -74,9 +87,14 @@ class CompanyTransformer:
             company_name=name, country="DK", company_id=tax_id, isic=classification.isic
         )
 
-    def transform(self, response: ParsedResponse) -> Iterable[CreateCompanyDto]:
+    def transform_versioned(
+        self, response: ParsedResponse
+    ) -> Iterable[tuple[Version, CreateCompanyDto]]:
         for hit in response.hits.hits:
-            yield from self._transform_company(hit.source.vrvirksomhed)
+            company = hit.source.vrvirksomhed
+            version = _extract_version(company)
+            for dto in self._transform_company(company):
+                yield version, dto
 
 
 def create_company_transformer() -> CompanyTransformer:
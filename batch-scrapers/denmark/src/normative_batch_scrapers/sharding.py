@@ -0,0 +1,254 @@
+# Copyright 2022 Meta Mind AB
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+from __future__ import annotations
+
+import asyncio
+import bisect
+import hashlib
+import logging
+from collections import defaultdict
+from concurrent.futures import Executor
+from dataclasses import dataclass, field
+from types import TracebackType
+from typing import TYPE_CHECKING, Callable, Container, Generic, Optional, Sequence, Type
+
+import httpx
+
+from normative_batch_scrapers.bulkupload import (
+    BodySettings,
+    BulkUploader,
+    TDto,
+    UploadResult,
+)
+
+if TYPE_CHECKING:
+    from company_service_client import Client
+
+log = logging.getLogger(__name__)
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent hash ring mapping keys onto a fixed set of nodes."""
+
+    def __init__(self, nodes: Sequence[str], vnodes: int = 64):
+        if not nodes:
+            raise ValueError("A hash ring needs at least one node")
+        points = sorted((_hash(f"{n}#{v}"), n) for n in nodes for v in range(vnodes))
+        self._hashes = [h for h, _ in points]
+        self._nodes = [n for _, n in points]
+
+    def lookup(self, key: str, exclude: Container[str] = ()) -> Optional[str]:
+        """
+        Return the node owning key. Keys owned by an excluded node fall through
+        to the next node on the ring, so only those keys move.
+        """
+        start = bisect.bisect(self._hashes, _hash(key))
+        for i in range(len(self._nodes)):
+            node = self._nodes[(start + i) % len(self._nodes)]
+            if node not in exclude:
+                return node
+        return None
+
+
+@dataclass
+class Endpoint:
+    url: str
+    uploader: BulkUploader
+    semaphore: asyncio.Semaphore
+    healthy: bool = True
+    in_flight: set[asyncio.Task] = field(default_factory=set)
+
+
+class ShardedUploader(Generic[TDto]):
+    """
+    Upload companies to several company service replicas. Companies are routed
+    by a consistent hash of their key so that upserts of the same company always
+    hit the same replica. Every replica has its own connection pool, in-flight
+    limit and health state.
+    """
+
+    def __init__(
+        self,
+        clients: Sequence[Client],
+        settings: BodySettings,
+        key: Callable[[TDto], str],
+        max_in_flight: int = 2,
+        health_check_interval: Optional[float] = 10,
+        executor: Optional[Executor] = None,
+        nbr_of_retries: int = 0,
+        cooldown_in_ms: Optional[int] = None,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.key = key
+        self.health_check_interval = health_check_interval
+        self.endpoints = {
+            c.base_url: Endpoint(
+                url=c.base_url,
+                uploader=BulkUploader(
+                    c,
+                    settings,
+                    executor=executor,
+                    # one connection more than uploads in flight, so that a busy
+                    # replica is not marked unhealthy waiting for a connection
+                    limits=httpx.Limits(max_connections=max_in_flight + 1),
+                    nbr_of_retries=nbr_of_retries,
+                    cooldown_in_ms=cooldown_in_ms,
+                    transport=transport,
+                ),
+                semaphore=asyncio.Semaphore(max_in_flight),
+            )
+            for c in clients
+        }
+        self._ring = HashRing(list(self.endpoints))
+        self._completed: list[UploadResult[TDto]] = []
+        self._health_task: Optional[asyncio.Task] = None
+
+    async def __aenter__(self) -> ShardedUploader[TDto]:
+        for ep in self.endpoints.values():
+            await ep.uploader.__aenter__()
+        await self.check_health()
+        if self.health_check_interval:
+            self._health_task = asyncio.create_task(self._monitor_health())
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc: Optional[BaseException],
+        tb: Optional[TracebackType],
+    ) -> None:
+        if self._health_task is not None:
+            self._health_task.cancel()
+        try:
+            for ep in self.endpoints.values():
+                if exc_type is None:
+                    await self.drain(ep.url)
+                else:
+                    for t in ep.in_flight:
+                        t.cancel()
+                    # let the uploads unwind before their client is closed
+                    await asyncio.gather(*ep.in_flight, return_exceptions=True)
+        finally:
+            for ep in self.endpoints.values():
+                await ep.uploader.__aexit__(exc_type, exc, tb)
+
+    async def check_health(self) -> None:
+        for ep, healthy in zip(
+            self.endpoints.values(),
+            await asyncio.gather(
+                *(ep.uploader.check_health() for ep in self.endpoints.values())
+            ),
+        ):
+            if ep.healthy and not healthy:
+                log.warning(f"Endpoint {ep.url} is unhealthy, routing around it")
+            elif not ep.healthy and healthy:
+                log.info(f"Endpoint {ep.url} is healthy again")
+            ep.healthy = healthy
+
+    async def _monitor_health(self) -> None:
+        assert self.health_check_interval
+        while True:
+            await asyncio.sleep(self.health_check_interval)
+            await self.check_health()
+
+    def _partition(self, dtos: Sequence[TDto]) -> dict[str, list[TDto]]:
+        """
+        Group dtos by the replica they are routed to, routing around unhealthy
+        replicas. When no replica is healthy dtos stay with their owner.
+        """
+        unhealthy = {url for url, ep in self.endpoints.items() if not ep.healthy}
+        if len(unhealthy) == len(self.endpoints):
+            unhealthy = set()
+        groups = defaultdict(list)
+        for d in dtos:
+            url = self._ring.lookup(self.key(d), exclude=unhealthy)
+            assert url is not None
+            groups[url].append(d)
+        return groups
+
+    def _deliver(
+        self,
+        result: UploadResult[TDto],
+        on_result: Optional[Callable[[UploadResult[TDto]], None]],
+    ) -> None:
+        if on_result is not None:
+            on_result(result)
+        else:
+            self._completed.append(result)
+
+    async def _send(
+        self,
+        ep: Endpoint,
+        dtos: Sequence[TDto],
+        on_result: Optional[Callable[[UploadResult[TDto]], None]],
+    ) -> None:
+        try:
+            result = await ep.uploader.upload(dtos)
+        except Exception as e:
+            # report rather than raise, so that the batch is not lost
+            log.error(f"Upload of {len(dtos)} companies to {ep.url} failed", exc_info=e)
+            result = UploadResult(ep.url, dtos, error=e)
+        finally:
+            ep.semaphore.release()
+        self._deliver(result, on_result)
+
+    async def submit(
+        self,
+        dtos: Sequence[TDto],
+        on_result: Optional[Callable[[UploadResult[TDto]], None]] = None,
+    ) -> list[asyncio.Task]:
+        """
+        Route a batch onto the replicas. Returns the scheduled uploads once
+        every sub-batch has been scheduled, waiting for a free in-flight slot
+        on the owning replica. Results are passed to on_result when given,
+        otherwise they are kept until harvested. When no replica is healthy
+        the sub-batches are not sent but reported as failed.
+        """
+        tasks = []
+        for url, group in self._partition(dtos).items():
+            ep = self.endpoints[url]
+            if not ep.healthy:
+                error = IOError("No healthy company service endpoint available")
+                self._deliver(UploadResult(url, group, error=error), on_result)
+                continue
+            await ep.semaphore.acquire()
+            task = asyncio.create_task(self._send(ep, group, on_result))
+            ep.in_flight.add(task)
+            task.add_done_callback(ep.in_flight.discard)
+            tasks.append(task)
+        return tasks
+
+    async def upload(self, dtos: Sequence[TDto]) -> list[UploadResult[TDto]]:
+        """Upload a batch and wait for it, one result per replica it was sent to."""
+        results: list[UploadResult[TDto]] = []
+        await asyncio.gather(*await self.submit(dtos, on_result=results.append))
+        return results
+
+    def harvest(self) -> list[UploadResult[TDto]]:
+        """Return and forget the results of all finished uploads."""
+        completed, self._completed = self._completed, []
+        return completed
+
+    async def drain(self, url: Optional[str] = None) -> None:
+        """
+        Wait for in-flight uploads, to one replica or all of them, to finish.
+        Their results are kept until harvested.
+        """
+        eps = [self.endpoints[url]] if url else list(self.endpoints.values())
+        await asyncio.gather(*(t for ep in eps for t in list(ep.in_flight)))
@@ -14,9 +14,22 @@
 #
 import asyncio
 import functools
+import itertools
 import logging
 from dataclasses import dataclass
-from typing import Any, AsyncIterable, Callable, Iterable, Optional, TypeVar, cast
+from typing import (
+    Any,
+    AsyncIterable,
+    Callable,
+    Iterable,
+    Optional,
+    Sequence,
+    TypeVar,
+    Union,
+    cast,
+)
+
+from pydantic import BaseSettings
 
 log = logging.getLogger(__name__)
 
@@ -31,6 +44,60 @@ async def aenumerate(ait: AsyncIterable[T]) -> AsyncIterable[tuple[int, T]]:
         i += 1
 
 
+class _Done:
+    ...
+
+
+@dataclass
+class _Failure:
+    error: BaseException
+
+
+async def amerge(
+    aits: Sequence[AsyncIterable[T]], maxsize: int = 1
+) -> AsyncIterable[T]:
+    """
+    Merge asyncronous iterables, reading ahead of the consumer. Every iterable
+    is consumed by its own task, so up to maxsize items are buffered while the
+    iterables already fetch their next items. The iterables are closed when the
+    merge is, e.g. to release open scrolls.
+    """
+    q: asyncio.Queue[Union[T, _Done, _Failure]] = asyncio.Queue(maxsize)
+
+    async def pump(ait: AsyncIterable[T]) -> None:
+        try:
+            async for t in ait:
+                await q.put(t)
+        except Exception as e:
+            await q.put(_Failure(e))
+        else:
+            await q.put(_Done())
+
+    tasks = [asyncio.create_task(pump(ait)) for ait in aits]
+    remaining = len(tasks)
+    try:
+        while remaining:
+            item = await q.get()
+            if isinstance(item, _Done):
+                remaining -= 1
+            elif isinstance(item, _Failure):
+                raise item.error
+            else:
+                yield item
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for ait in aits:
+            if (aclose := getattr(ait, "aclose", None)) is not None:
+                await aclose()
+
+
+class RetrySettings(BaseSettings):
+    nbr_of_retries: int = 3
+    cooldown_in_ms: int = 50
+
+
 TCallable = TypeVar("TCallable", bound=Callable[..., Any])
 
 
@@ -42,7 +109,8 @@ def retry_async(
         for i in range(nbr_of_retries):
             try:
                 return await func(*args, **kwargs)
-            except:
+            except Exception:
+                # cancellation is not retried
                 log.warning(f"retry nbr {i}", exc_info=True)
             if cooldown_in_ms is not None:
                 await asyncio.sleep(cooldown_in_ms / 1000)
@@ -59,8 +127,8 @@ def coro(f):
     return wrapper
 
 
-def batch(iterable: list[T], n: int = 1) -> Iterable[list[T]]:
-    """Batch a list into a sequence of lists"""
-    l = len(iterable)
-    for ndx in range(0, l, n):
-        yield iterable[ndx : min(ndx + n, l)]
+def chunked(iterable: Iterable[T], n: int = 1) -> Iterable[list[T]]:
+    """Batch an iterable into a sequence of lists"""
+    it = iter(iterable)
+    while chunk := list(itertools.islice(it, n)):
+        yield chunk
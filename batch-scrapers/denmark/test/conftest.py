@@ -0,0 +1,72 @@
+# Copyright 2022 Meta Mind AB
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+from dataclasses import dataclass, field
+from typing import Any, Callable, Sequence
+
+import httpx
+import pytest
+
+from normative_batch_scrapers.bulkupload import BodySettings
+from normative_batch_scrapers.sharding import ShardedUploader
+
+_url = "http://company-service"
+
+Handler = Callable[[httpx.Request], Any]
+
+
+@dataclass
+class FakeClient:
+    """Stands in for the generated company service client."""
+
+    base_url: str = _url
+    verify_ssl: bool = False
+    headers: dict[str, str] = field(default_factory=dict)
+
+    def get_headers(self) -> dict[str, str]:
+        return self.headers
+
+    def get_cookies(self) -> dict[str, str]:
+        return {}
+
+    def get_timeout(self) -> float:
+        return 5.0
+
+
+@pytest.fixture
+def client() -> Any:
+    return FakeClient()
+
+
+@pytest.fixture
+def sharded_uploader() -> Callable[..., ShardedUploader]:
+    """
+    Return a factory of sharded uploaders whose replicas are served by a mock
+    transport. Requests carry their replica url in the x-replica header.
+    """
+
+    def make(
+        handler: Handler, urls: Sequence[str] = (_url,), **kwargs: Any
+    ) -> ShardedUploader:
+        clients: list[Any] = [FakeClient(u, headers={"x-replica": u}) for u in urls]
+        return ShardedUploader(
+            clients,
+            BodySettings(),
+            key=lambda d: d.company_id,
+            health_check_interval=None,
+            transport=httpx.MockTransport(handler),
+            **kwargs,
+        )
+
+    return make
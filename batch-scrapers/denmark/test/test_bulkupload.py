@@ -0,0 +1,81 @@
+# Copyright 2022 Meta Mind AB
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import gzip
+import json
+from dataclasses import asdict, dataclass
+from typing import Any
+
+import httpx
+import pytest
+
+from normative_batch_scrapers.bulkupload import BodySettings, BulkUploader, encode_body
+
+
+@dataclass
+class _Dto:
+    companyId: str
+    country: str
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+_dtos = [_Dto(companyId="1", country="DK"), _Dto(companyId="2", country="DK")]
+
+
+def test_encode_json_body():
+    body = encode_body(_dtos, BodySettings())
+    assert body.headers == {"Content-Type": "application/json"}
+    assert json.loads(body.content) == [d.to_dict() for d in _dtos]
+    assert body.nbr_of_records == 2
+
+
+def test_encode_gzipped_ndjson_body():
+    body = encode_body(_dtos, BodySettings(gzip=True, ndjson=True))
+    assert body.headers["Content-Encoding"] == "gzip"
+    assert body.headers["Content-Type"] == "application/x-ndjson"
+    lines = gzip.decompress(body.content).decode().splitlines()
+    assert [json.loads(l) for l in lines] == [d.to_dict() for d in _dtos]
+
+
+@pytest.mark.asyncio
+async def test_upload_batches_in_order(client: Any):
+    posted: list[Any] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        posted.append(json.loads(request.content))
+        return httpx.Response(201)
+
+    batches = [[_Dto(companyId=str(i), country="DK")] for i in range(3)]
+    uploader = BulkUploader(
+        client,
+        BodySettings(),
+        url="http://company-service/company/many",
+        transport=httpx.MockTransport(handler),
+    )
+    async with uploader:
+        results = [r async for r in uploader.upload_batches(batches)]
+        assert [r async for r in uploader.upload_batches(batches[:0])] == []
+    assert [r.ok for r in results] == [True, True, True]
+    assert [r.dtos for r in results] == batches
+    assert posted == [[d.to_dict() for d in b] for b in batches]
+
+
+def test_body_settings_are_prefixed(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setenv("GZIP", "true")
+    monkeypatch.setenv("UPLOAD_NDJSON", "true")
+    settings = BodySettings()
+    assert not settings.gzip
+    assert settings.ndjson
@@ -0,0 +1,32 @@
+# Copyright 2022 Meta Mind AB
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+from pathlib import Path
+
+from normative_batch_scrapers.deadletter import DeadLetterStore
+
+
+def test_dead_letters_roundtrip_in_order(tmp_path: Path):
+    store = DeadLetterStore(tmp_path / "dead-letters")
+    assert len(store) == 0
+    store.put([{"companyId": "1"}], status_code=500, error="boom")
+    store.put([{"companyId": "2"}, {"companyId": "3"}], status_code=None, error="")
+    letters = list(store)
+    assert [l.records for l in letters] == [
+        [{"companyId": "1"}],
+        [{"companyId": "2"}, {"companyId": "3"}],
+    ]
+    assert letters[0].status_code == 500 and letters[0].error == "boom"
+    store.remove(letters[0])
+    assert len(store) == 1
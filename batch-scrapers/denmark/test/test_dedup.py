@@ -0,0 +1,59 @@
+# Copyright 2022 Meta Mind AB
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+from pathlib import Path
+
+import pytest
+
+from normative_batch_scrapers.dedup import DedupIndex
+
+
+def _index(tmp_path: Path, max_in_memory: int) -> DedupIndex[dict]:
+    return DedupIndex(
+        tmp_path, to_record=dict, from_record=dict, max_in_memory=max_in_memory
+    )
+
+
+@pytest.mark.parametrize("max_in_memory", [100, 1])
+def test_keeps_latest_version(tmp_path: Path, max_in_memory: int):
+    with _index(tmp_path, max_in_memory) as index:
+        index.add("1", "2020-01-01", dict(name="new"))
+        index.add("2", "2019-01-01", dict(name="other"))
+        index.add("1", "2010-01-01", dict(name="old"))
+        index.add("1", "2020-01-01", dict(name="newest"))
+        assert sorted(d["name"] for d in index) == ["newest", "other"]
+        assert len(index) == 2
+        assert index.nbr_of_duplicates == 2
+
+
+def test_spill_file_is_removed(tmp_path: Path):
+    with _index(tmp_path, max_in_memory=1) as index:
+        index.add("1", "a", {})
+        index.add("2", "a", {})
+        assert any(tmp_path.iterdir())
+    assert not any(tmp_path.iterdir())
+
+
+def test_spill_on_demand(tmp_path: Path):
+    with _index(tmp_path, max_in_memory=100) as index:
+        index.add("1", "a", dict(name="first"))
+        index.spill()
+        assert any(tmp_path.iterdir())
+        index.add("1", "b", dict(name="second"))
+        items = iter(index)
+        assert next(items) == dict(name="second")
+        # entries being iterated over are not spilled
+        index.spill()
+        assert list(items) == []
+        assert len(index) == 1
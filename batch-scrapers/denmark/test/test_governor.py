@@ -0,0 +1,170 @@
+# Copyright 2022 Meta Mind AB
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import asyncio
+from typing import Optional
+
+import pytest
+
+from normative_batch_scrapers.governor import (
+    GovernorSettings,
+    MemoryGovernor,
+    governed,
+    process_tree_rss,
+)
+from normative_batch_scrapers.util import amerge
+
+_MB = 1024 * 1024
+
+
+class _Memory:
+    def __init__(self, rss: Optional[int]):
+        self.rss = rss
+
+    def __call__(self) -> Optional[int]:
+        return self.rss
+
+
+def _governor(memory: _Memory) -> MemoryGovernor:
+    settings = GovernorSettings(
+        soft_limit_mb=100, hard_limit_mb=200, poll_interval_ms=1, max_delay_ms=10
+    )
+    return MemoryGovernor(settings, rss=memory)
+
+
+def test_process_tree_rss():
+    rss = process_tree_rss()
+    assert rss is None or rss > 0
+
+
+def test_soft_limit_must_be_below_hard_limit():
+    with pytest.raises(ValueError):
+        MemoryGovernor(GovernorSettings(soft_limit_mb=200, hard_limit_mb=100))
+
+
+@pytest.mark.asyncio
+async def test_below_soft_limit_is_not_throttled():
+    async with _governor(_Memory(50 * _MB)) as governor:
+        await governor.throttle("download")
+    assert governor.throttled == {}
+
+
+@pytest.mark.asyncio
+async def test_between_limits_is_slowed_down():
+    async with _governor(_Memory(150 * _MB)) as governor:
+        await governor.throttle("transform")
+    assert governor.throttled["transform"] > 0
+
+
+@pytest.mark.asyncio
+async def test_above_hard_limit_pauses_until_below_soft_limit():
+    memory = _Memory(250 * _MB)
+    async with _governor(memory) as governor:
+        paused = asyncio.create_task(governor.throttle("upload"))
+        await asyncio.sleep(0.02)
+        assert not paused.done()
+        # dropping below the hard limit is not enough to resume
+        memory.rss = 150 * _MB
+        await asyncio.sleep(0.02)
+        assert not paused.done()
+        memory.rss = 50 * _MB
+        await asyncio.wait_for(paused, timeout=1)
+    assert governor.throttled["upload"] >= 0.04
+
+
+@pytest.mark.asyncio
+async def test_unreadable_memory_disables_governor():
+    async with _governor(_Memory(None)) as governor:
+        assert not governor.enabled
+        await governor.throttle("download")
+
+
+@pytest.mark.asyncio
+async def test_governed_yields_all_items():
+    async def numbers():
+        for i in range(3):
+            yield i
+
+    async with _governor(_Memory(150 * _MB)) as governor:
+        assert [i async for i in governed(numbers(), governor, "download")] == [
+            0,
+            1,
+            2,
+        ]
+    assert governor.throttled["download"] > 0
+
+
+@pytest.mark.asyncio
+async def test_pause_is_bounded():
+    memory = _Memory(250 * _MB)
+    settings = GovernorSettings(
+        soft_limit_mb=100,
+        hard_limit_mb=200,
+        poll_interval_ms=1,
+        max_delay_ms=10,
+        max_pause_ms=100,
+    )
+    async with MemoryGovernor(settings, rss=memory) as governor:
+        await asyncio.wait_for(governor.throttle("upload"), timeout=1)
+        assert governor.throttled["upload"] >= 0.1
+        # once the pause ran out the stage carries on at the slowest rate
+        await asyncio.wait_for(governor.throttle("upload"), timeout=0.05)
+        # a stage can be capped below the governor's max pause
+        await asyncio.wait_for(governor.throttle("download", 5), timeout=0.05)
+
+
+@pytest.mark.asyncio
+async def test_pressure_callbacks_fire_above_hard_limit():
+    memory = _Memory(150 * _MB)
+    spilled: list[int] = []
+    async with _governor(memory) as governor:
+        remove = governor.on_pressure(lambda: spilled.append(memory.rss))
+        await asyncio.sleep(0.01)
+        assert spilled == []
+        memory.rss = 250 * _MB
+        await asyncio.sleep(0.01)
+        # only fired when crossing the watermark
+        assert spilled == [250 * _MB]
+        memory.rss = 50 * _MB
+        await asyncio.sleep(0.01)
+        remove()
+        memory.rss = 250 * _MB
+        await asyncio.sleep(0.01)
+    assert spilled == [250 * _MB]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("limited", [False, True])
+async def test_governed_iterables_are_closed_by_amerge(limited: bool):
+    closed: list[str] = []
+
+    async def endless(name: str):
+        try:
+            while True:
+                await asyncio.sleep(0)
+                yield name
+        finally:
+            closed.append(name)
+
+    async with _governor(_Memory(50 * _MB)) as governor:
+        merged = amerge(
+            [
+                governed(endless(name), governor if limited else None, "download")
+                for name in ("a", "b")
+            ]
+        )
+        async for _ in merged:
+            break
+        await merged.aclose()  # type: ignore
+    assert sorted(closed) == ["a", "b"]
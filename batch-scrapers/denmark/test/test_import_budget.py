@@ -0,0 +1,109 @@
+# Copyright 2022 Meta Mind AB
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+# Modules imported by each cli command before it starts doing any work. The
+# upload command lazily pulls in the generated client, the deduplication index
+# and, in the process pool workers, the transformer.
+_COMMAND_IMPORTS = {
+    "download": ["denmark_scraper"],
+    "upload": [
+        "denmark_scraper",
+        "company_service_client",
+        "normative_batch_scrapers.dedup",
+        "normative_batch_scrapers.scraper.denmark.transformer",
+    ],
+}
+
+# Third party modules each command needs anyway. The budgets are on top of
+# them, so that they do not depend on the versions installed.
+_DEPENDENCY_IMPORTS = {
+    "download": ["click", "httpx", "pydantic"],
+    "upload": [
+        "click",
+        "httpx",
+        "pydantic",
+        "company_service_client",
+        "company_service_client.api.company.company_controller_add_many",
+        "company_service_client.models.create_company_dto",
+    ],
+}
+
+# measured at 26 and 32 modules
+_MODULE_BUDGET = {"download": 29, "upload": 35}
+# relative to the import time of the dependencies, measured at 1.1-1.3 times
+# with room for noisy machines
+_IMPORT_TIME_BUDGET = 2.0
+
+_NEVER_IMPORTED = ["black", "pandas", "pydoc", "tkinter"]
+_NOT_IMPORTED_BY_DOWNLOAD = [
+    "company_service_client",
+    "normative_batch_scrapers.dedup",
+    "normative_batch_scrapers.scraper.denmark.transformer",
+]
+
+_PROBE = """
+import importlib, json, sys, time
+before = set(sys.modules)
+start = time.perf_counter()
+for m in sys.argv[1:]:
+    importlib.import_module(m)
+elapsed = time.perf_counter() - start
+print(json.dumps(dict(elapsed=elapsed, modules=sorted(set(sys.modules) - before))))
+"""
+
+
+def _probe(modules: list[str], runs: int = 3) -> dict:
+    """Import modules in fresh interpreters, keeping the fastest run."""
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        ["scrapers", "src", *filter(None, [env.get("PYTHONPATH")])]
+    )
+    results = [
+        json.loads(
+            subprocess.run(
+                [sys.executable, "-c", _PROBE, *modules],
+                env=env,
+                check=True,
+                capture_output=True,
+                text=True,
+            ).stdout
+        )
+        for _ in range(runs)
+    ]
+    return min(results, key=lambda r: r["elapsed"])
+
+
+def _top_level_or_self(modules: list[str], name: str) -> bool:
+    return any(m == name or m.startswith(name + ".") for m in modules)
+
+
+@pytest.mark.parametrize("command", list(_COMMAND_IMPORTS))
+def test_command_import_budget(command: str):
+    dependencies = _probe(_DEPENDENCY_IMPORTS[command])
+    result = _probe(_COMMAND_IMPORTS[command])
+    modules = result["modules"]
+    forbidden = _NEVER_IMPORTED + (
+        _NOT_IMPORTED_BY_DOWNLOAD if command == "download" else []
+    )
+    assert [f for f in forbidden if _top_level_or_self(modules, f)] == []
+    extra = set(modules) - set(dependencies["modules"])
+    assert len(extra) <= _MODULE_BUDGET[command], sorted(extra)
+    assert result["elapsed"] <= _IMPORT_TIME_BUDGET * dependencies["elapsed"]
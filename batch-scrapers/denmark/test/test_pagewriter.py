@@ -0,0 +1,37 @@
+# Copyright 2022 Meta Mind AB
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+from pathlib import Path
+
+import pytest
+
+from normative_batch_scrapers.pagewriter import PageWriter
+
+
+@pytest.mark.asyncio
+async def test_pages_are_written(tmp_path: Path):
+    async with PageWriter(tmp_path, queue_size=1, fsync_every=2) as writer:
+        for i in range(5):
+            await writer.write(f"{i}.json", f"page {i}")
+    assert writer.nbr_of_pages == 5
+    assert sorted(p.read_text() for p in tmp_path.iterdir()) == [
+        f"page {i}" for i in range(5)
+    ]
+
+
+@pytest.mark.asyncio
+async def test_write_errors_are_raised(tmp_path: Path):
+    with pytest.raises(IOError):
+        async with PageWriter(tmp_path / "missing") as writer:
+            await writer.write("0.json", "page")
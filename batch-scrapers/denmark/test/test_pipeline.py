@@ -0,0 +1,200 @@
+# Copyright 2022 Meta Mind AB
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import json
+from pathlib import Path
+from typing import Any, Callable
+
+import httpx
+import pytest
+from pydantic import ValidationError
+
+from normative_batch_scrapers.bulkupload import BodySettings, BulkUploader, UploadResult
+from normative_batch_scrapers.deadletter import DeadLetterStore
+from normative_batch_scrapers.pipeline import (
+    RunSummary,
+    UploaderSettings,
+    _is_rejection,
+    _replay_letters,
+    dead_letter,
+)
+from normative_batch_scrapers.sharding import ShardedUploader
+
+_url = "http://company-service"
+
+
+def _record(company_id: str) -> dict[str, Any]:
+    return dict(companyName=f"c{company_id}", country="DK", companyId=company_id)
+
+
+class _Service:
+    """Mock company service refusing poison records, counting the requests."""
+
+    def __init__(self, respond: Callable[[list[str]], httpx.Response]):
+        self.respond = respond
+        self.nbr_of_posts = 0
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        if request.method != "POST":
+            return httpx.Response(200)
+        self.nbr_of_posts += 1
+        return self.respond([r["companyId"] for r in json.loads(request.content)])
+
+
+def _rejecting(poison: set[str]) -> _Service:
+    def respond(ids: list[str]) -> httpx.Response:
+        if bad := sorted(poison.intersection(ids)):
+            return httpx.Response(400, json={"message": f"invalid companies {bad}"})
+        return httpx.Response(201)
+
+    return _Service(respond)
+
+
+async def _replay(
+    make_uploader: Callable[..., ShardedUploader],
+    service: _Service,
+    store: DeadLetterStore,
+) -> RunSummary:
+    summary = RunSummary()
+    async with make_uploader(service) as uploader:
+        await _replay_letters(uploader, store, summary)
+    return summary
+
+
+@pytest.mark.asyncio
+async def test_replay_isolates_rejected_records(tmp_path: Path, sharded_uploader: Any):
+    store = DeadLetterStore(tmp_path)
+    store.put([_record(str(i)) for i in range(8)], status_code=400, error="")
+    summary = await _replay(sharded_uploader, _rejecting({"3", "6"}), store)
+    assert sorted(l.records[0]["companyId"] for l in store) == ["3", "6"]
+    assert all(len(l.records) == 1 and l.status_code == 400 for l in store)
+    assert summary.nbr_of_replayed_companies == 6
+    assert summary.nbr_of_failed_companies == 2
+
+
+@pytest.mark.asyncio
+async def test_replay_stops_when_service_is_unavailable(
+    tmp_path: Path, sharded_uploader: Any
+):
+    store = DeadLetterStore(tmp_path)
+    for i in range(3):
+        store.put([_record(str(i)), _record(str(i + 10))], status_code=503, error="")
+    before = [(l.path, l.records) for l in store]
+    service = _Service(lambda ids: httpx.Response(503, text="<html>"))
+    summary = await _replay(sharded_uploader, service, store)
+    assert service.nbr_of_posts == 1
+    assert [(l.path, l.records) for l in store] == before
+    assert summary.nbr_of_failed_batches == 3
+    assert summary.nbr_of_failed_companies == 6
+
+
+def _failing(poison: set[str]) -> _Service:
+    """Refuse any batch with a poison record, without saying which."""
+
+    def respond(ids: list[str]) -> httpx.Response:
+        if poison.intersection(ids):
+            return httpx.Response(
+                500, json={"statusCode": 500, "message": "Internal server error"}
+            )
+        return httpx.Response(201)
+
+    return _Service(respond)
+
+
+@pytest.mark.asyncio
+async def test_replay_isolates_records_failing_alike(
+    tmp_path: Path, sharded_uploader: Any
+):
+    store = DeadLetterStore(tmp_path)
+    store.put([_record(str(i)) for i in range(8)], status_code=500, error="")
+    summary = await _replay(sharded_uploader, _failing({"1", "6"}), store)
+    assert sorted(l.records[0]["companyId"] for l in store) == ["1", "6"]
+    assert all(len(l.records) == 1 for l in store)
+    assert summary.nbr_of_replayed_companies == 6
+
+
+@pytest.mark.asyncio
+async def test_replay_splits_within_budget(tmp_path: Path, sharded_uploader: Any):
+    store = DeadLetterStore(tmp_path)
+    store.put([_record(str(i)) for i in range(8)], status_code=500, error="")
+    service = _failing({str(i) for i in range(8)})
+    summary = RunSummary()
+    async with sharded_uploader(service) as uploader:
+        await _replay_letters(uploader, store, summary, max_split_uploads=3)
+    # the whole batch and its halves, a quarter would exceed the budget
+    assert service.nbr_of_posts == 3
+    assert sorted(len(l.records) for l in store) == [4, 4]
+    assert summary.nbr_of_replayed_companies == 0
+    assert summary.nbr_of_failed_companies == 8
+
+
+@pytest.mark.parametrize(
+    "response,rejection",
+    [
+        (httpx.Response(400, json={}), True),
+        (httpx.Response(409, json={}), True),
+        (httpx.Response(500, json={"message": "Internal server error"}), True),
+        (httpx.Response(500, text="<html>Internal Server Error</html>"), False),
+        (httpx.Response(502), False),
+        (httpx.Response(503), False),
+        (httpx.Response(504), False),
+        (httpx.Response(429), False),
+        (None, False),
+    ],
+)
+def test_is_rejection(response: Any, rejection: bool):
+    result: UploadResult[Any] = UploadResult(_url, [], response=response)
+    assert _is_rejection(result) == rejection
+
+
+@pytest.mark.asyncio
+async def test_failed_upload_is_retried_and_dead_lettered(tmp_path: Path, client: Any):
+    from company_service_client.models.create_company_dto import CreateCompanyDto
+
+    service = _Service(lambda ids: httpx.Response(503, text="unavailable"))
+    store = DeadLetterStore(tmp_path)
+    summary = RunSummary()
+    dtos = [CreateCompanyDto.from_dict(_record("1"))]
+    uploader = BulkUploader(
+        client,
+        BodySettings(),
+        url=f"{_url}/company/many",
+        nbr_of_retries=2,
+        transport=httpx.MockTransport(service),
+    )
+    async with uploader:
+        result = await uploader.upload(dtos)
+    assert service.nbr_of_posts == 3
+    assert not result.ok and result.status_code == 503
+    dead_letter(result, store, summary)
+    [letter] = list(store)
+    assert letter.status_code == 503
+    assert letter.error == "503: unavailable"
+    assert letter.records == [_record("1")]
+    assert summary.nbr_of_failed_batches == 1
+
+
+def test_uploader_settings_need_an_endpoint(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+):
+    # keep a developer's .env out of the way
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv("API_URL", raising=False)
+    monkeypatch.delenv("API_URLS", raising=False)
+    with pytest.raises(ValidationError):
+        UploaderSettings()
+    with pytest.raises(ValidationError):
+        UploaderSettings(api_urls=["not a url"])
+    settings = UploaderSettings(api_urls=["http://api-0:3000", "http://api-1:3000"])
+    assert settings.endpoint_urls == ["http://api-0:3000", "http://api-1:3000"]
@@ -0,0 +1,195 @@
+# Copyright 2022 Meta Mind AB
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import asyncio
+import json
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Sequence
+
+import httpx
+import pytest
+
+from normative_batch_scrapers import runner
+from normative_batch_scrapers.governor import GovernorSettings, process_tree_rss
+from normative_batch_scrapers.pipeline import RunSummary, UploaderSettings
+from normative_batch_scrapers.runner import (
+    RunnerSettings,
+    RunnerState,
+    ScraperRunner,
+    schedule,
+)
+from normative_batch_scrapers.scraper.base import BatchScraper
+from normative_batch_scrapers.sharding import ShardedUploader
+
+
+class _Scraper(BatchScraper):
+    def __init__(self, name: str, priority: int = 0):
+        self.name = name
+        self.priority = priority
+
+    async def download(self, work_path: Path, governor=None) -> None:
+        ...
+
+    async def transform(self, work_path: Path, pool: Executor, governor=None):
+        yield []
+
+
+def test_schedule_orders_by_priority_then_staleness(tmp_path: Path):
+    state = RunnerState(tmp_path / "state.json")
+    state.record_success("fresh", 200.0)
+    state.record_success("stale", 100.0)
+    scrapers = [
+        _Scraper("fresh"),
+        _Scraper("stale"),
+        _Scraper("never"),
+        _Scraper("important", priority=1),
+    ]
+    assert [s.name for s in schedule(scrapers, state)] == [
+        "important",
+        "never",
+        "stale",
+        "fresh",
+    ]
+
+
+def test_runner_state_is_persisted(tmp_path: Path):
+    state = RunnerState(tmp_path / "state.json")
+    state.record_success("denmark", 1.0)
+    state.save()
+    assert RunnerState(tmp_path / "state.json").last_success == {"denmark": 1.0}
+
+
+def _pid() -> int:
+    return os.getpid()
+
+
+class _CompanyScraper(_Scraper):
+    def __init__(self, name: str, company_ids: list[str]):
+        super().__init__(name)
+        self.company_ids = company_ids
+        self.pools: list[Executor] = []
+
+    async def download(self, work_path: Path, governor=None) -> None:
+        if not self.company_ids:
+            raise IOError("registry unavailable")
+        (work_path / "companies.json").write_text(json.dumps(self.company_ids))
+
+    async def transform(self, work_path: Path, pool: Executor, governor=None):
+        from company_service_client.models.create_company_dto import CreateCompanyDto
+
+        self.pools.append(pool)
+        assert await asyncio.wrap_future(pool.submit(_pid)) != os.getpid()
+        company_ids = json.loads((work_path / "companies.json").read_text())
+        yield [
+            ("", CreateCompanyDto(company_name=i, country="DK", company_id=i))
+            for i in company_ids
+        ]
+
+
+async def _run(
+    scrapers: Sequence[BatchScraper],
+    handler: Callable[[httpx.Request], httpx.Response],
+    work_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    sharded_uploader: Any,
+    runner_settings: RunnerSettings = RunnerSettings(max_transform_workers=1),
+) -> tuple[dict[str, RunSummary], list[ShardedUploader]]:
+    """Run scrapers against a mock company service."""
+    uploaders: list[ShardedUploader] = []
+
+    def make_sharded_uploader(upload_settings: UploaderSettings) -> ShardedUploader:
+        uploader = sharded_uploader(handler)
+        uploaders.append(uploader)
+        return uploader
+
+    monkeypatch.setattr(runner, "make_sharded_uploader", make_sharded_uploader)
+    summaries = await ScraperRunner(
+        scrapers,
+        UploaderSettings(api_url="http://127.0.0.1:3000", batch_size=1),
+        runner_settings,
+        work_path,
+    ).run()
+    return summaries, uploaders
+
+
+@pytest.mark.asyncio
+async def test_runner_shares_pool_and_uploader(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, sharded_uploader: Any
+):
+    posted: list[str] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.method == "POST":
+            posted.extend(r["companyId"] for r in json.loads(request.content))
+        return httpx.Response(201)
+
+    scrapers = [
+        _CompanyScraper("first", ["1", "2"]),
+        _CompanyScraper("second", ["3"]),
+        _CompanyScraper("broken", []),
+    ]
+    summaries, uploaders = await _run(
+        scrapers, handler, tmp_path, monkeypatch, sharded_uploader
+    )
+    assert len(uploaders) == 1
+    assert sorted(posted) == ["1", "2", "3"]
+    [first_pool], [second_pool] = scrapers[0].pools, scrapers[1].pools
+    assert first_pool is second_pool
+    assert isinstance(first_pool, ProcessPoolExecutor)
+    assert summaries["first"].nbr_of_companies == 2
+    assert summaries["second"].nbr_of_companies == 1
+    # a failing scraper does not stop the others, but is not marked as fresh
+    state = RunnerState(tmp_path / "runner-state.json")
+    assert set(state.last_success) == {"first", "second"}
+
+
+@pytest.mark.asyncio
+async def test_runner_does_not_mark_dead_lettered_scraper_fresh(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, sharded_uploader: Any
+):
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.method == "POST":
+            return httpx.Response(503, text="unavailable")
+        return httpx.Response(200)
+
+    scrapers = [_CompanyScraper("first", ["1", "2"])]
+    summaries, _ = await _run(
+        scrapers, handler, tmp_path, monkeypatch, sharded_uploader
+    )
+    assert summaries["first"].nbr_of_failed_batches == 2
+    assert RunnerState(tmp_path / "runner-state.json").last_success == {}
+
+
+@pytest.mark.asyncio
+async def test_runner_reports_time_throttled(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, sharded_uploader: Any
+):
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(201)
+
+    if process_tree_rss() is None:
+        pytest.skip("memory use can not be read")
+    # always above the soft watermark, far from the hard one
+    settings = RunnerSettings(
+        max_transform_workers=1,
+        governor_settings=GovernorSettings(soft_limit_mb=1, hard_limit_mb=2**20),
+    )
+    scrapers = [_CompanyScraper("first", ["1", "2"]), _CompanyScraper("second", ["3"])]
+    summaries, _ = await _run(
+        scrapers, handler, tmp_path, monkeypatch, sharded_uploader, settings
+    )
+    assert summaries["first"].throttled_seconds["upload"] > 0
+    assert summaries["first"].throttled_seconds == summaries["second"].throttled_seconds
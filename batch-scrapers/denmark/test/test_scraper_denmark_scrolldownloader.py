@@ -16,6 +16,8 @@ import pytest
 
 from normative_batch_scrapers.scraper.denmark.scrolldownloader import (
     DownloaderSettings,
+    _build_initial_request,
+    _slice_scroll_limit,
     scroll,
 )
 from normative_batch_scrapers.util import aenumerate
@@ -28,3 +30,33 @@ async def test_initial_scroll_post() -> None:
     async for i, resp in aenumerate(scroll(downloader_settings, raw=True)):
         with open(f"test/data/example_resp_{i}.json", mode="w") as f:
             f.write(resp)
+
+
+def test_initial_request_for_slice() -> None:
+    assert "slice" not in _build_initial_request(10)
+    assert _build_initial_request(10, slice_id=1, max_slices=4)["slice"] == {
+        "id": 1,
+        "max": 4,
+    }
+
+
+@pytest.mark.parametrize(
+    "scroll_limit,scroll_slices,slice_id,expected",
+    [
+        (None, 4, 0, None),
+        (8, 1, None, 8),
+        (8, 4, 0, 2),
+        (9, 4, 3, 3),
+        (2, 4, 3, 1),
+    ],
+)
+def test_scroll_limit_is_shared_by_slices(
+    scroll_limit, scroll_slices, slice_id, expected
+) -> None:
+    settings = DownloaderSettings(
+        username="user",
+        password="secret",
+        scroll_limit=scroll_limit,
+        scroll_slices=scroll_slices,
+    )
+    assert _slice_scroll_limit(settings, slice_id) == expected
@@ -0,0 +1,120 @@
+# Copyright 2022 Meta Mind AB
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+from pathlib import Path
+from typing import Any, Optional
+
+import pytest
+
+from normative_batch_scrapers.dedup import DedupIndex
+from normative_batch_scrapers.scraper.denmark.classification_mappings import (
+    Classification,
+    DkSic,
+    Isic,
+    Nace,
+)
+from normative_batch_scrapers.scraper.denmark.response_parser import (
+    ParsedResponse,
+    Vrvirksomhed,
+)
+from normative_batch_scrapers.scraper.denmark.transformer import (
+    CompanyTransformer,
+    _extract_version,
+)
+
+_Period = tuple[Optional[str], Optional[str]]
+
+
+def _company(
+    names: list[tuple[str, _Period]], branches: list[tuple[int, _Period]]
+) -> dict[str, Any]:
+    def periode(p: _Period) -> dict[str, Optional[str]]:
+        return {"gyldigFra": p[0], "gyldigTil": p[1]}
+
+    return {
+        "cvrNummer": 12345678,
+        "navne": [{"navn": n, "periode": periode(p)} for n, p in names],
+        "hovedbranche": [
+            {"branchekode": b, "branchetekst": "", "periode": periode(p)}
+            for b, p in branches
+        ],
+    }
+
+
+# the same company as seen in an early and a late registry snapshot
+_early = _company(
+    names=[("Old Name ApS", ("2010-01-01", None))],
+    branches=[(1, ("2010-01-01", None))],
+)
+_late = _company(
+    names=[
+        ("Old Name ApS", ("2010-01-01", "2015-06-30")),
+        ("New Name ApS", ("2015-07-01", None)),
+    ],
+    branches=[(1, ("2010-01-01", "2017-12-31")), (2, ("2018-01-01", None))],
+)
+# the company was later dissolved, closing all of its periods
+_dissolved = _company(
+    names=[
+        ("Old Name ApS", ("2010-01-01", "2015-06-30")),
+        ("New Name ApS", ("2015-07-01", "2021-03-31")),
+    ],
+    branches=[(1, ("2010-01-01", "2017-12-31")), (2, ("2018-01-01", "2021-03-31"))],
+)
+
+
+def _version(company: dict[str, Any]) -> str:
+    return _extract_version(Vrvirksomhed.parse_obj(company))
+
+
+def test_later_change_is_newer():
+    assert _version(_early) == "2010-01-01"
+    assert _version(_late) == "2018-01-01"
+    assert _version(_late) > _version(_early)
+
+
+def test_closing_open_ended_periods_is_newer():
+    assert _version(_dissolved) == "2021-03-31"
+    assert _version(_dissolved) > _version(_late)
+
+
+def test_version_without_periods_is_oldest():
+    assert _version(_company(names=[], branches=[])) < _version(_early)
+
+
+@pytest.mark.parametrize(
+    "snapshots",
+    [[_early, _late, _dissolved], [_dissolved, _late, _early], [_late, _dissolved]],
+)
+def test_latest_snapshot_wins_deduplication(tmp_path: Path, snapshots: list[dict]):
+    transformer = CompanyTransformer(
+        classification_mappings={
+            DkSic("1"): Classification(Nace("A"), Isic("A1")),
+            DkSic("2"): Classification(Nace("B"), Isic("B2")),
+        }
+    )
+    response = ParsedResponse.parse_obj(
+        {
+            "_scroll_id": "1",
+            "hits": {"hits": [{"_source": {"Vrvirksomhed": c}} for c in snapshots]},
+        }
+    )
+    with DedupIndex(tmp_path, to_record=vars, from_record=dict) as index:
+        for version, dto in transformer.transform_versioned(response):
+            index.add(dto.company_id, version, dto)
+        [dto] = list(index)
+        assert index.nbr_of_duplicates == len(snapshots) - 1
+    assert dto.company_id == "12345678"
+    assert dto.company_name == "New Name ApS"
+    assert dto.isic == "B2"
@@ -0,0 +1,207 @@
+# Copyright 2022 Meta Mind AB
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import asyncio
+import json
+from collections import defaultdict
+from dataclasses import asdict, dataclass
+from typing import Any
+
+import httpx
+import pytest
+
+from normative_batch_scrapers.sharding import HashRing
+
+_nodes = ["http://api-0:3000", "http://api-1:3000", "http://api-2:3000"]
+_keys = [str(cvr) for cvr in range(10000000, 10001000)]
+
+
+def test_hash_ring_is_stable():
+    first, second = HashRing(_nodes), HashRing(list(reversed(_nodes)))
+    assert [first.lookup(k) for k in _keys] == [second.lookup(k) for k in _keys]
+
+
+def test_hash_ring_spreads_keys_over_nodes():
+    ring = HashRing(_nodes)
+    assert {ring.lookup(k) for k in _keys} == set(_nodes)
+
+
+def test_hash_ring_only_moves_keys_of_excluded_node():
+    ring = HashRing(_nodes)
+    for k in _keys:
+        owner = ring.lookup(k)
+        fallback = ring.lookup(k, exclude={_nodes[0]})
+        assert fallback != _nodes[0]
+        if owner != _nodes[0]:
+            assert fallback == owner
+
+
+def test_hash_ring_without_nodes_left():
+    assert HashRing(_nodes).lookup("1", exclude=set(_nodes)) is None
+
+
+@dataclass
+class _Dto:
+    company_id: str
+
+    def to_dict(self) -> dict[str, Any]:
+        return asdict(self)
+
+
+@pytest.fixture
+def make_uploader(sharded_uploader: Any) -> Any:
+    return lambda handler, **kwargs: sharded_uploader(handler, _nodes, **kwargs)
+
+
+@pytest.mark.asyncio
+async def test_sharded_uploader_routes_by_key(make_uploader: Any):
+    received: dict[str, list[str]] = defaultdict(list)
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.method == "POST":
+            replica = request.headers["x-replica"]
+            received[replica] += [r["company_id"] for r in json.loads(request.content)]
+        return httpx.Response(200)
+
+    dtos = [_Dto(k) for k in _keys[:200]]
+    async with make_uploader(handler) as uploader:
+        for i in range(0, len(dtos), 50):
+            await uploader.submit(dtos[i : i + 50])
+        await uploader.drain()
+        results = uploader.harvest()
+    ring = HashRing(_nodes)
+    assert all(r.ok for r in results)
+    assert sum(len(r.dtos) for r in results) == len(dtos)
+    for r in results:
+        assert {ring.lookup(d.company_id) for d in r.dtos} == {r.url}
+    for replica, keys in received.items():
+        assert {ring.lookup(k) for k in keys} == {replica}
+
+
+@pytest.mark.asyncio
+async def test_sharded_uploader_limits_uploads_in_flight(make_uploader: Any):
+    release = asyncio.Event()
+    in_flight = max_in_flight = 0
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        nonlocal in_flight, max_in_flight
+        if request.method == "POST":
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+            await release.wait()
+            in_flight -= 1
+        return httpx.Response(200)
+
+    ring = HashRing(_nodes)
+    keys = [k for k in _keys if ring.lookup(k) == _nodes[0]][:5]
+    async with make_uploader(handler, max_in_flight=2) as uploader:
+        submitting = asyncio.gather(*(uploader.submit([_Dto(k)]) for k in keys))
+        await asyncio.sleep(0.05)
+        assert not submitting.done()
+        assert max_in_flight == 2
+        release.set()
+        await submitting
+        await uploader.drain()
+        assert len(uploader.harvest()) == len(keys)
+    assert max_in_flight == 2
+
+
+@pytest.mark.asyncio
+async def test_sharded_uploader_routes_around_unhealthy_replica(make_uploader: Any):
+    down = {_nodes[0]}
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.headers["x-replica"] in down:
+            return httpx.Response(503)
+        return httpx.Response(200)
+
+    ring = HashRing(_nodes)
+    dtos = [_Dto(k) for k in _keys[:200]]
+    async with make_uploader(handler) as uploader:
+        await uploader.submit(dtos)
+        await uploader.drain()
+        failed_over = uploader.harvest()
+        # the replica comes back and gets its keys back
+        down.clear()
+        await uploader.check_health()
+        await uploader.submit(dtos)
+        await uploader.drain()
+        recovered = uploader.harvest()
+    assert all(r.ok for r in failed_over + recovered)
+    assert _nodes[0] not in {r.url for r in failed_over}
+    for r in failed_over:
+        for d in r.dtos:
+            owner = ring.lookup(d.company_id)
+            assert owner == r.url or owner == _nodes[0]
+    for r in recovered:
+        assert {ring.lookup(d.company_id) for d in r.dtos} == {r.url}
+
+
+@dataclass
+class _BrokenDto(_Dto):
+    def to_dict(self) -> dict[str, Any]:
+        raise ValueError("can not encode")
+
+
+@pytest.mark.asyncio
+async def test_sharded_uploader_reports_upload_exceptions(make_uploader: Any):
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200)
+
+    async with make_uploader(handler) as uploader:
+        results = await uploader.upload([_BrokenDto(_keys[0])])
+        results += await uploader.upload([_Dto(_keys[1])])
+    assert isinstance(results[0].error, ValueError)
+    assert not results[0].ok
+    assert results[1].ok
+
+
+@pytest.mark.asyncio
+async def test_sharded_uploader_fails_batches_without_healthy_replica(
+    make_uploader: Any,
+):
+    posts = 0
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        nonlocal posts
+        posts += request.method == "POST"
+        return httpx.Response(503)
+
+    dtos = [_Dto(k) for k in _keys[:100]]
+    async with make_uploader(handler) as uploader:
+        results = await uploader.upload(dtos)
+    assert posts == 0
+    assert all(isinstance(r.error, IOError) for r in results)
+    assert sorted(d.company_id for r in results for d in r.dtos) == _keys[:100]
+
+
+@pytest.mark.asyncio
+async def test_sharded_uploader_cancels_uploads_on_error(make_uploader: Any):
+    posts = 0
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        nonlocal posts
+        if request.method == "POST":
+            posts += 1
+            await asyncio.sleep(10)
+        return httpx.Response(200)
+
+    with pytest.raises(ValueError):
+        async with make_uploader(handler, nbr_of_retries=2) as uploader:
+            tasks = await uploader.submit([_Dto(_keys[0])])
+            await asyncio.sleep(0.01)
+            raise ValueError("scraper failed")
+    assert all(t.cancelled() for t in tasks)
+    assert posts == 1
+    assert uploader.harvest() == []
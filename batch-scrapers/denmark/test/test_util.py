@@ -0,0 +1,94 @@
+# Copyright 2022 Meta Mind AB
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import asyncio
+
+import pytest
+
+from normative_batch_scrapers.util import amerge, chunked, retry_async
+
+
+def test_chunked():
+    assert list(chunked(range(5), n=2)) == [[0, 1], [2, 3], [4]]
+
+
+async def _produce(name: str, n: int, fetched: list[str]):
+    for i in range(n):
+        await asyncio.sleep(0)
+        fetched.append(f"{name}{i}")
+        yield f"{name}{i}"
+
+
+@pytest.mark.asyncio
+async def test_amerge_reads_ahead_of_consumer():
+    fetched: list[str] = []
+    merged = amerge([_produce("a", 5, fetched)], maxsize=2)
+    assert await merged.__anext__() == "a0"
+    await asyncio.sleep(0.01)
+    # one item consumed, two buffered and one waiting to be put
+    assert fetched == ["a0", "a1", "a2", "a3"]
+    assert [p async for p in merged] == ["a1", "a2", "a3", "a4"]
+
+
+@pytest.mark.asyncio
+async def test_amerge_merges_all_iterables():
+    fetched: list[str] = []
+    merged = amerge([_produce("a", 3, fetched), _produce("b", 2, fetched)])
+    assert sorted([p async for p in merged]) == ["a0", "a1", "a2", "b0", "b1"]
+
+
+@pytest.mark.asyncio
+async def test_amerge_propagates_errors():
+    async def failing():
+        yield "ok"
+        raise IOError("boom")
+
+    with pytest.raises(IOError):
+        [p async for p in amerge([failing()])]
+
+
+@pytest.mark.asyncio
+async def test_amerge_closes_iterables():
+    closed: list[str] = []
+
+    async def endless(name: str):
+        try:
+            while True:
+                await asyncio.sleep(0)
+                yield name
+        finally:
+            closed.append(name)
+
+    merged = amerge([endless("a"), endless("b")])
+    async for _ in merged:
+        break
+    await merged.aclose()  # type: ignore
+    assert sorted(closed) == ["a", "b"]
+
+
+@pytest.mark.asyncio
+async def test_retry_async_does_not_retry_cancellation():
+    started = 0
+
+    async def hang() -> None:
+        nonlocal started
+        started += 1
+        await asyncio.sleep(10)
+
+    task = asyncio.create_task(retry_async(hang, nbr_of_retries=2)())
+    await asyncio.sleep(0)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert started == 1